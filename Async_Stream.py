@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: asyncio interface to USB_Mouse. Movement_Stream
+    multiplexes several devices into one asynchronous iterator and
+    next_movement() awaits the next movement of a single device.
+    Neither polls: the event loop watches the wakeup pipe of each
+    device's movement buffer.
+
+    Version: Python 3.5+ '''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import queue
+
+class Movement_Stream(object):
+    ''' Asynchronous iterator over the movements of several devices.
+
+        Reading starts on first use. Every device is read by a worker
+        of one shared executor, since the transports block in libusb
+        and have no descriptor the event loop could watch. Reading
+        stops when the stream is closed or all readers exit, and the
+        first exception raised by a reader is raised again once they
+        are awaited. Movements are taken from each device in turn so a
+        busy device cannot starve the others. The stream never buffers
+        movements itself, so a slow consumer leaves them in the device
+        buffers where their overflow policy applies. '''
+
+    def __init__(self, devices, label=False, verbosity=0):
+        self.devices = devices      # USB_Mouse objects to read
+        self.label = label          # Label data by device
+        self.verbosity = verbosity  # Representation, 0 for Mouse_Movement objects
+
+        self.event = Event()        # Shared variable to synchronize readers
+        self.executor = None        # Executor running the readers
+        self.readers = []           # Futures of the running readers
+        self.next_index = 0         # Device to take the next movement from
+
+    def start(self):
+        ''' Start reading every device in the executor '''
+
+        loop = asyncio.get_event_loop()
+
+        self.event.set()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.devices)))
+
+        for device in self.devices:
+            device.reading = True
+
+            # Undo a previous multiprocess read or interrupted buffer
+            device.use_ring_buffer()
+            device.movements.resume()
+            self.readers.append(loop.run_in_executor(self.executor, device.read_thread_loop, self.event))
+
+    def close(self):
+        ''' Signal the readers to stop without waiting for them. Each
+            exits after its current read times out '''
+
+        if(self.executor is not None):
+            self.event.clear()
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def aclose(self):
+        ''' Stop reading and await the readers, leaving the event loop
+            free while their reads time out. Raises the first exception
+            a reader exited with '''
+
+        self.close()
+
+        readers, self.readers = self.readers, []
+        if(not readers):
+            return
+
+        # Every reader is awaited before an exception is raised again
+        results = await asyncio.gather(*readers, return_exceptions=True)
+        for result in results:
+            if(isinstance(result, BaseException)):
+                raise result
+
+    def __del__(self):
+        # Signal the readers if the stream is dropped without closing it
+        self.event.clear()
+
+    def poll(self):
+        ''' Take one movement from the next device that has one '''
+
+        for offset in range(len(self.devices)):
+            device = self.devices[(self.next_index + offset) % len(self.devices)]
+
+            try:
+                movement = device.movements.get(block=False)
+            except queue.Empty:
+                continue
+
+            self.next_index = (self.next_index + offset + 1) % len(self.devices)
+            return device.format_movement(movement, self.label, self.verbosity)
+
+        return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if(self.executor is None and not self.event.is_set()):
+            self.start()
+
+        while(True):
+            movement = self.poll()
+            if(movement is not None):
+                return movement
+
+            # Finished once every reader has exited and the buffers are drained
+            if(not any(device.reading for device in self.devices)):
+                await self.aclose()
+                raise StopAsyncIteration
+
+            await wait_readable([device.movements for device in self.devices], 0.5)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.aclose()
+
+async def wait_readable(buffers, timeout=None):
+    ''' Sleep until one of the movement buffers holds data. Returns
+        False on timeout '''
+
+    loop = asyncio.get_event_loop()
+    waiter = loop.create_future()
+    fds = [movements.fileno() for movements in buffers]
+
+    def wake():
+        if(not waiter.done()):
+            waiter.set_result(True)
+
+    # Readers are only registered while waiting, since the wakeup pipes
+    # stay readable for as long as the buffers hold movements
+    for fd in fds:
+        loop.add_reader(fd, wake)
+
+    try:
+        done, pending = await asyncio.wait([waiter], timeout=timeout)
+        return len(done) > 0
+
+    finally:
+        for fd in fds:
+            loop.remove_reader(fd)
+        waiter.cancel()
+
+async def next_movement(device, label=False, verbosity=0, timeout=None):
+    ''' Await the next movement of a device. Raises
+        asyncio.TimeoutError if none arrives within timeout seconds '''
+
+    loop = asyncio.get_event_loop()
+    end = None if timeout is None else loop.time() + timeout
+
+    while(True):
+        try:
+            return device.format_movement(device.movements.get(block=False), label, verbosity)
+        except queue.Empty:
+            pass
+
+        remaining = None if end is None else end - loop.time()
+        if(remaining is not None and remaining <= 0):
+            raise asyncio.TimeoutError
+
+        await wait_readable([device.movements], remaining)
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Cached index of attached USB devices. The bus is
+    enumerated once, and the index is kept current by libusb hotplug
+    callbacks when python-libusb1 is installed, so devices can be
+    found and connected without prompts or repeated enumeration.
+
+    Version: Python 2.7 '''
+
+from collections import namedtuple
+from threading import Thread, Lock
+
+# pyusb is only needed to enumerate physical devices
+try:
+    import usb.core
+except ImportError:
+    usb = None
+
+# python-libusb1 is only needed for hotplug notifications
+try:
+    import usb1
+except ImportError:
+    usb1 = None
+
+# HID interface class and mouse boot protocol
+HID_CLASS = 3
+MOUSE_PROTOCOL = 2
+
+# One attached device. mouse is set if it has a HID mouse interface
+Device_Entry = namedtuple('Device_Entry', ['vendor', 'product', 'bus', 'address', 'mouse'])
+
+def is_mouse(entry):
+    ''' Default match for devices to connect '''
+
+    return entry.mouse
+
+def pyusb_entry(device):
+    ''' Build an entry from a pyusb device '''
+
+    mouse = False
+    try:
+        mouse = any(interface.bInterfaceClass == HID_CLASS and
+                    interface.bInterfaceProtocol == MOUSE_PROTOCOL
+                    for config in device for interface in config)
+    except (usb.core.USBError, NotImplementedError):
+        pass
+
+    return Device_Entry(int(device.idVendor), int(device.idProduct),
+                        device.bus, device.address, mouse)
+
+def libusb1_entry(device):
+    ''' Build an entry from a python-libusb1 device '''
+
+    mouse = False
+    try:
+        mouse = any(setting.getClass() == HID_CLASS and
+                    setting.getProtocol() == MOUSE_PROTOCOL
+                    for setting in device.iterSettings())
+    except usb1.USBError:
+        pass
+
+    return Device_Entry(device.getVendorID(), device.getProductID(),
+                        device.getBusNumber(), device.getDeviceAddress(), mouse)
+
+class Device_Index(object):
+    ''' Attached USB devices keyed by (bus, address).
+
+        Without hotplug support a lookup that finds nothing enumerates
+        the bus again, so devices attached later are still found. '''
+
+    def __init__(self):
+        self.entries = {}           # (bus, address) -> Device_Entry
+        self.lock = Lock()          # Hotplug events arrive on another thread
+        self.enumerated = False     # Bus has been enumerated
+        self.listeners = []         # Called with (entry, attached) on hotplug
+
+        self.context = None         # python-libusb1 context when hotplug is on
+        self.thread = None          # Thread handling hotplug events
+        self.events = []            # Hotplug events waiting for the listeners
+
+    def enumerate(self):
+        ''' Replace the index with the devices currently attached '''
+
+        if(usb is None):
+            raise ImportError("pyusb is required to find physical devices")
+
+        entries = {}
+        for device in usb.core.find(find_all=True):
+            entry = pyusb_entry(device)
+            entries[(entry.bus, entry.address)] = entry
+
+        with self.lock:
+            self.entries = entries
+            self.enumerated = True
+
+    def start_hotplug(self):
+        ''' Keep the index current with hotplug callbacks. Returns
+            False if hotplug is unavailable '''
+
+        if(self.context is not None):
+            return True
+
+        if(usb1 is None):
+            return False
+
+        context = usb1.USBContext()
+        if(not context.hasCapability(usb1.CAP_HAS_HOTPLUG)):
+            context.close()
+            return False
+
+        self.context = context
+        self.context.hotplugRegisterCallback(self.hotplug_callback)
+
+        self.thread = Thread(target=self.hotplug_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+        return True
+
+    def hotplug_callback(self, context, device, event):
+        ''' Update the index. Runs inside libusb, so listeners are
+            called afterwards from the hotplug thread '''
+
+        attached = event == usb1.HOTPLUG_EVENT_DEVICE_ARRIVED
+
+        if(attached):
+            entry = libusb1_entry(device)
+        else:
+            entry = Device_Entry(device.getVendorID(), device.getProductID(),
+                                 device.getBusNumber(), device.getDeviceAddress(), False)
+
+        with self.lock:
+            if(attached):
+                self.entries[(entry.bus, entry.address)] = entry
+            else:
+                entry = self.entries.pop((entry.bus, entry.address), entry)
+
+            self.events.append((entry, attached))
+
+        # Stay registered
+        return False
+
+    def hotplug_loop(self):
+        ''' Handle hotplug events until stopped '''
+
+        while(self.context is not None):
+            try:
+                self.context.handleEventsTimeout(0.5)
+            except usb1.USBError:
+                continue
+
+            with self.lock:
+                events, self.events = self.events, []
+
+            for entry, attached in events:
+                for listener in list(self.listeners):
+                    listener(entry, attached)
+
+    def stop_hotplug(self):
+        ''' Stop hotplug callbacks '''
+
+        context, self.context = self.context, None
+
+        if(self.thread is not None):
+            self.thread.join()
+            self.thread = None
+
+        if(context is not None):
+            context.close()
+
+    def add_listener(self, listener):
+        ''' Call listener(entry, attached) for every device attached or
+            detached. Starts hotplug if it is available '''
+
+        if(listener not in self.listeners):
+            self.listeners.append(listener)
+
+        return self.start_hotplug()
+
+    def remove_listener(self, listener):
+        if(listener in self.listeners):
+            self.listeners.remove(listener)
+
+    def find(self, vendor=None, product=None, bus=None, address=None, match=None):
+        ''' Return the entries with the given IDs and location that are
+            accepted by match(entry), ordered by bus and address '''
+
+        if(not self.enumerated):
+            self.enumerate()
+            self.start_hotplug()
+
+        entries = self.select(vendor, product, bus, address, match)
+
+        # Without hotplug the index may be stale
+        if(len(entries) == 0 and self.context is None):
+            self.enumerate()
+            entries = self.select(vendor, product, bus, address, match)
+
+        return entries
+
+    def select(self, vendor, product, bus, address, match):
+        ''' Filter the index without enumerating '''
+
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda entry: (entry.bus, entry.address))
+
+        return [entry for entry in entries
+                if (vendor is None or entry.vendor == vendor) and
+                   (product is None or entry.product == product) and
+                   (bus is None or entry.bus == bus) and
+                   (address is None or entry.address == address) and
+                   (match is None or match(entry))]
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Mouse_Movement parameters for known mouse models and
+    a calibrator that infers them. Profiles are stored in a JSON file
+    keyed by vendor and product ID. The calibrator is a pipeline stage
+    that keeps a histogram of every report column while the user moves
+    the mouse right, left, up and down, then picks the movement
+    columns, their ranges and their directions from the histograms.
+    Devices decoded with a HID report layout only need their
+    directions, which are taken from the sign of their summed movement.
+
+    Version: Python 2.7 '''
+
+import json
+import os
+
+# Mouse_Movement parameters stored in a profile
+PROFILE_KEYS = ('lr_col', 'ud_col', 'lr_max', 'ud_max', 'rev_lr', 'rev_ud')
+
+# Guided movements, in order
+PHASES = ("right", "left", "up", "down")
+
+class Profile_Registry(object):
+    ''' Mouse_Movement parameters by vendor and product ID, stored in a
+        JSON file '''
+
+    default_path = os.path.join(os.path.expanduser("~"), ".usb_mouse_profiles.json")
+
+    def __init__(self, path=None):
+        self.path = path or Profile_Registry.default_path  # Profile file
+        self.profiles = None                                # Loaded on first use
+
+    @staticmethod
+    def key(vendor, prod_id):
+        return "%04x:%04x" % (vendor, prod_id)
+
+    def load(self):
+        ''' Read the profile file. A missing file holds no profiles '''
+
+        try:
+            with open(self.path) as profile_file:
+                self.profiles = json.load(profile_file)
+        except (IOError, OSError, ValueError):
+            self.profiles = {}
+
+        return self.profiles
+
+    def get(self, vendor, prod_id):
+        ''' Return the parameters of a model as a dictionary, or None if
+            the model is unknown '''
+
+        if(self.profiles is None):
+            self.load()
+
+        profile = self.profiles.get(Profile_Registry.key(vendor, prod_id))
+        if(profile is None):
+            return None
+
+        return dict((key, profile[key]) for key in PROFILE_KEYS if key in profile)
+
+    def set(self, vendor, prod_id, config, save=True):
+        ''' Store the parameters of a model '''
+
+        if(self.profiles is None):
+            self.load()
+
+        self.profiles[Profile_Registry.key(vendor, prod_id)] = dict(config)
+
+        if(save):
+            self.save()
+
+    def remove(self, vendor, prod_id, save=True):
+        if(self.profiles is None):
+            self.load()
+
+        self.profiles.pop(Profile_Registry.key(vendor, prod_id), None)
+
+        if(save):
+            self.save()
+
+    def save(self):
+        ''' Write the profile file, replacing it in one step so readers
+            never see a partial file '''
+
+        temporary = self.path + ".tmp"
+
+        with open(temporary, "w") as profile_file:
+            json.dump(self.profiles, profile_file, indent=4, sort_keys=True)
+
+        os.rename(temporary, self.path)
+
+class Calibrator(object):
+    ''' Pipeline stage that infers Mouse_Movement parameters from
+        guided movement.
+
+        samples = reports with movement collected per phase
+        layout = Report_Layout of the device, if it has one '''
+
+    def __init__(self, samples=50, size=8, layout=None):
+        self.samples = samples      # Reports per phase
+        self.size = size            # Report columns
+        self.layout = layout        # Report_Layout, None for column decoding
+
+        # Histogram of the nonzero values of each column, per phase
+        self.histograms = dict((phase, [[0] * 256 for column in range(size)])
+                               for phase in PHASES)
+        self.counts = dict((phase, 0) for phase in PHASES)     # Reports per phase
+        self.deltas = dict((phase, [0, 0]) for phase in PHASES) # Summed (x, y) with a layout
+        self.phase = None                                       # Phase being collected
+
+    def start(self, phase):
+        ''' Begin collecting a phase '''
+
+        self.phase = phase
+
+    def ready(self):
+        ''' Return True once the current phase has enough reports '''
+
+        return self.phase is None or self.counts[self.phase] >= self.samples
+
+    def write(self, device, movement):
+        ''' Add one report to the current phase '''
+
+        phase = self.phase
+        if(phase is None or self.counts[phase] >= self.samples):
+            return
+
+        # Decoded fields before reversal, with y positive upward
+        if(self.layout is not None):
+            d_x = movement.fields[1]
+            d_y = -movement.fields[2]
+
+            if(d_x != 0 or d_y != 0):
+                self.deltas[phase][0] += d_x
+                self.deltas[phase][1] += d_y
+                self.counts[phase] += 1
+            return
+
+        raw = bytearray(movement.data)
+
+        # Reports without movement carry no information
+        moved = False
+        histogram = self.histograms[phase]
+        for column in range(1, min(len(raw), self.size)):
+            if(raw[column] > 0):
+                histogram[column][raw[column]] += 1
+                moved = True
+
+        if(moved):
+            self.counts[phase] += 1
+
+    def activity(self, phases):
+        ''' Return the nonzero value count of each column in the phases '''
+
+        return [sum(sum(self.histograms[phase][column]) for phase in phases)
+                for column in range(self.size)]
+
+    def below_median(self, phase, column, maximum):
+        ''' Return the fraction of nonzero values of a column in a phase
+            that are below the median of its range '''
+
+        histogram = self.histograms[phase][column]
+        median = (maximum + 1) // 2
+        total = sum(histogram)
+
+        if(total == 0):
+            return 0.5
+
+        return sum(histogram[1:median]) / float(total)
+
+    def maximum(self, phases, column):
+        ''' Return the range of a column, the smallest all-ones value
+            covering the values seen '''
+
+        values = [value for phase in phases
+                  for value, count in enumerate(self.histograms[phase][column]) if count > 0]
+
+        if(len(values) == 0):
+            return 255
+
+        return 2 ** len(bin(max(values))[2:]) - 1
+
+    def result(self):
+        ''' Return the inferred parameters as a dictionary, or None if
+            the movement was not clear enough '''
+
+        if(any(self.counts[phase] == 0 for phase in PHASES)):
+            return None
+
+        # The layout gives the columns and ranges, only the directions
+        # are inferred
+        if(self.layout is not None):
+            horizontal = self.deltas["right"][0] - self.deltas["left"][0]
+            vertical = self.deltas["up"][1] - self.deltas["down"][1]
+
+            if(horizontal == 0 or vertical == 0):
+                return None
+
+            return {"rev_lr": 0 if horizontal > 0 else 1,
+                    "rev_ud": 0 if vertical > 0 else 1}
+
+        # The columns that change with one direction of movement and
+        # not the other. Columns that change with both, such as a
+        # held button, cancel out
+        horizontal = self.activity(("right", "left"))
+        vertical = self.activity(("up", "down"))
+
+        lr_score = [h - v for h, v in zip(horizontal, vertical)]
+        ud_score = [v - h for h, v in zip(horizontal, vertical)]
+
+        lr_col = lr_score.index(max(lr_score))
+        ud_col = ud_score.index(max(ud_score))
+
+        if(lr_col == ud_col or lr_score[lr_col] <= 0 or ud_score[ud_col] <= 0):
+            return None
+
+        lr_max = self.maximum(("right", "left"), lr_col)
+        ud_max = self.maximum(("up", "down"), ud_col)
+
+        # By default values below the median are right and down movement
+        right = self.below_median("right", lr_col, lr_max)
+        up = self.below_median("up", ud_col, ud_max)
+
+        return {"lr_col": lr_col, "ud_col": ud_col,
+                "lr_max": lr_max, "ud_max": ud_max,
+                "rev_lr": 0 if right > 0.5 else 1,
+                "rev_ud": 1 if up > 0.5 else 0}
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Runtime counters for reading devices and a scrape
+    endpoint. Device_Stats counts the reports, timeouts, errors by
+    errno and movement build time of one device's reading thread.
+    Stats_Server serves the statistics of connected devices in the
+    Prometheus text format over HTTP on localhost.
+
+    Version: Python 2.7 '''
+
+from collections import Counter
+from threading import Thread
+
+# The HTTP server module was renamed in Python 3
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from Report_Timing import monotonic
+
+class Device_Stats(object):
+    ''' Counters for one device. Only the reading thread updates them,
+        so updates take no lock. The errors counter is replaced rather
+        than changed, so other threads can copy it while it grows '''
+
+    def __init__(self):
+        self.reports = 0            # Reports read
+        self.timeouts = 0           # Reads that returned nothing
+        self.errors = Counter()     # Transport errors by errno, None if unknown
+        self.rejected = 0           # Reports that did not hold movement
+        self.build_ns = 0           # Total time building movements
+
+        self.rate = None            # Reports per second at the last sample
+        self.sample = (monotonic(), 0)  # (time, reports) of the last rate sample
+
+    def start(self):
+        ''' Start measuring the rate, called when a read begins '''
+
+        self.rate = None
+        self.sample = (monotonic(), self.reports)
+
+    def add_report(self, build_ns):
+        ''' Count a report and the time taken to build its movement '''
+
+        self.reports += 1
+        self.build_ns += build_ns
+
+    def add_error(self, errno):
+        errors = Counter(self.errors)
+        errors[errno] += 1
+        self.errors = errors
+
+    def get_rate(self, period=1.0):
+        ''' Return reports per second since the previous sample. The
+            sample is only moved once period seconds have passed, so
+            frequent readers see a stable rate. Until then the first
+            rate is measured from the start of the read '''
+
+        now = monotonic()
+        elapsed = now - self.sample[0]
+
+        if(elapsed >= period or (self.rate is None and elapsed > 0)):
+            self.rate = (self.reports - self.sample[1]) / elapsed
+
+            if(elapsed >= period):
+                self.sample = (now, self.reports)
+
+        return self.rate
+
+    def get_build_us(self):
+        ''' Return the mean time to build a movement in microseconds '''
+
+        if(self.reports == 0):
+            return None
+
+        return self.build_ns / 1000.0 / self.reports
+
+# Prometheus metrics as (name, type, help, get_stats key)
+METRICS = (("usb_mouse_reports_total", "counter", "Reports read.", "Reports"),
+           ("usb_mouse_reports_per_second", "gauge", "Reports read per second.", "Reports_Per_Sec"),
+           ("usb_mouse_timeouts_total", "counter", "Reads that timed out.", "Timeouts"),
+           ("usb_mouse_errors_total", "counter", "Transport errors by errno.", "Errors"),
+           ("usb_mouse_rejected_total", "counter", "Reports without movement.", "Rejected"),
+           ("usb_mouse_build_seconds_mean", "gauge", "Mean time to build a movement.", "Build_us"),
+           ("usb_mouse_queue_depth", "gauge", "Movements waiting in the buffer.", "Queue_Depth"),
+           ("usb_mouse_queue_high_water", "gauge", "Most movements buffered at once.", "High_Water"),
+           ("usb_mouse_dropped_total", "counter", "Movements dropped by a full buffer.", "Dropped"))
+
+def format_metrics(devices):
+    ''' Return the statistics of devices in the Prometheus text format '''
+
+    stats = [(device, dict(device.get_stats())) for device in devices]
+    lines = []
+
+    for name, kind, description, key in METRICS:
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+        for device, values in stats:
+            labels = 'device="%d",vendor="%04x",product="%04x"' % (
+                device.num, max(device.vendor, 0), max(device.prod_id, 0))
+            value = values[key]
+
+            if(key == "Errors"):
+                for errno, count in sorted(value.items(), key=lambda item: str(item[0])):
+                    lines.append('%s{%s,errno="%s"} %d' % (
+                        name, labels, "unknown" if errno is None else errno, count))
+                continue
+
+            if(value is None):
+                continue
+
+            if(key == "Build_us"):
+                value = value / 1e6
+
+            if(not isinstance(value, int)):
+                value = repr(float(value))
+
+            lines.append("%s{%s} %s" % (name, labels, value))
+
+    return "\n".join(lines) + "\n"
+
+class Stats_Handler(BaseHTTPRequestHandler):
+    ''' Serve the metrics at /metrics '''
+
+    def do_GET(self):
+        if(self.path.split("?")[0] != "/metrics"):
+            self.send_error(404)
+            return
+
+        body = format_metrics(self.server.get_devices()).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes are not logged to the terminal
+    def log_message(self, format, *args):
+        pass
+
+class Stats_Server(object):
+    ''' HTTP endpoint serving device statistics from a background thread.
+
+        get_devices = function returning the devices to report
+        port = TCP port, 0 picks a free one
+        host = address to bind, localhost by default '''
+
+    def __init__(self, get_devices, port=9464, host="127.0.0.1"):
+        self.server = HTTPServer((host, port), Stats_Handler)
+        self.server.get_devices = get_devices
+        self.port = self.server.server_address[1]   # Bound port
+
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        ''' Stop serving and close the socket '''
+
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
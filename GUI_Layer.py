@@ -10,9 +10,130 @@
 
     Version: Python 2.7 '''
 
+from collections import deque
+import math
 import sys
+import time
 from PyQt4 import QtCore, QtGui
 from USB_Device import Mouse_Movement, USB_Mouse
+from Plot_Buffer import Speed_Trace, Path_Trace
+from Report_Timing import monotonic
+
+REFRESH_RATE = 30       # Display updates per second
+LIST_CAPACITY = 1000    # Movements kept in the data list
+PLOT_COLUMNS = 400      # Pixel columns of the speed trace
+PLOT_SPAN = 10.0        # Seconds shown by the speed trace
+PATH_CAPACITY = 2000    # Points kept of the path
+
+class Movement_List_Model(QtCore.QAbstractListModel):
+    ''' List model holding the most recent movements, newest first.
+        Rows live in a fixed capacity ring, so the oldest rows are
+        dropped as new ones arrive '''
+
+    def __init__(self, capacity=LIST_CAPACITY, parent=None):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.capacity = capacity                # Maximum rows
+        self.rows = deque(maxlen=capacity)      # Row text, newest first
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if(parent.isValid()):
+            return 0
+        return len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if(role == QtCore.Qt.DisplayRole and index.isValid() and index.row() < len(self.rows)):
+            return self.rows[index.row()]
+        return None
+
+    def add_rows(self, rows):
+        ''' Add a batch of rows, oldest first, in one update '''
+
+        rows = rows[-self.capacity:]
+        if(len(rows) == 0):
+            return
+
+        # Drop the oldest rows that no longer fit
+        overflow = len(self.rows) + len(rows) - self.capacity
+        if(overflow > 0):
+            self.beginRemoveRows(QtCore.QModelIndex(), len(self.rows) - overflow, len(self.rows) - 1)
+            for row in range(overflow):
+                self.rows.pop()
+            self.endRemoveRows()
+
+        self.beginInsertRows(QtCore.QModelIndex(), 0, len(rows) - 1)
+        self.rows.extendleft(rows)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows.clear()
+        self.endResetModel()
+
+class Motion_Plot(QtGui.QWidget):
+    ''' Live plot of one device: the cumulative path on the left and a
+        scrolling speed trace on the right. Both are drawn from
+        decimated buffers, so a redraw costs the same however many
+        reports have arrived '''
+
+    def __init__(self, path, speed, parent=None):
+        QtGui.QWidget.__init__(self, parent)
+        self.path = path        # Path_Trace of the device
+        self.speed = speed      # Speed_Trace of the device, counts per second
+        self.setMinimumHeight(150)
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.fillRect(self.rect(), QtCore.Qt.white)
+
+        half = self.width() // 2
+        self.draw_path(painter, QtCore.QRectF(0, 0, half, self.height()).adjusted(5, 5, -5, -5))
+        self.draw_speed(painter, QtCore.QRectF(half, 0, self.width() - half, self.height()).adjusted(5, 5, -5, -5))
+
+        painter.end()
+
+    def draw_path(self, painter, area):
+        ''' Draw the path scaled to fit, with y upward '''
+
+        painter.setPen(QtCore.Qt.lightGray)
+        painter.drawRect(area)
+
+        points = self.path.get_points()
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+
+        # Keep the aspect ratio so distances are comparable
+        span = max(max(xs) - min(xs), max(ys) - min(ys), 1)
+        scale = min(area.width(), area.height()) / float(span)
+        center_x = (max(xs) + min(xs)) / 2.0
+        center_y = (max(ys) + min(ys)) / 2.0
+
+        polygon = QtGui.QPolygonF([QtCore.QPointF(area.center().x() + (x - center_x) * scale,
+                                                  area.center().y() - (y - center_y) * scale)
+                                   for x, y in points])
+
+        painter.setPen(QtCore.Qt.blue)
+        painter.drawPolyline(polygon)
+
+    def draw_speed(self, painter, area):
+        ''' Draw one vertical line per column from its minimum to its
+            maximum speed, newest on the right '''
+
+        painter.setPen(QtCore.Qt.lightGray)
+        painter.drawRect(area)
+
+        columns = self.speed.get_columns(monotonic())
+        top = max([column[1] for column in columns if column is not None] or [0]) or 1
+        step = area.width() / float(len(columns))
+
+        painter.setPen(QtCore.Qt.darkGreen)
+        for index, column in enumerate(columns):
+            if(column is None):
+                continue
+
+            x = area.left() + index * step
+            painter.drawLine(QtCore.QPointF(x, area.bottom() - column[0] / float(top) * area.height()),
+                             QtCore.QPointF(x, area.bottom() - column[1] / float(top) * area.height()))
 
 class Ui_MainWindow(QtGui.QMainWindow):
     ''' Main window of the GUI '''
@@ -67,12 +188,21 @@ class Ui_MainWindow(QtGui.QMainWindow):
         self.data_list_label.setObjectName(_fromUtf8("data_list_label"))
         self.verticalLayout.addWidget(self.data_list_label)
 
-        # Build widget for data list
-        self.data_list = QtGui.QListWidget(self.centralwidget)
-        self.data_list.setBatchSize(1)
+        # Build widget for data list, backed by a fixed size model
+        self.data_model = Movement_List_Model(LIST_CAPACITY, self)
+        self.data_list = QtGui.QListView(self.centralwidget)
+        self.data_list.setModel(self.data_model)
+        self.data_list.setUniformItemSizes(True)
         self.data_list.setObjectName(_fromUtf8("data_list"))
         self.verticalLayout.addWidget(self.data_list)
 
+        # Build widget for the path and speed plot
+        self.path = Path_Trace(PATH_CAPACITY)
+        self.speed = Speed_Trace(PLOT_COLUMNS, PLOT_SPAN)
+        self.plot = Motion_Plot(self.path, self.speed, self.centralwidget)
+        self.plot.setObjectName(_fromUtf8("plot"))
+        self.verticalLayout.addWidget(self.plot)
+
         # Build widget for stop button
         self.stop_button = QtGui.QPushButton("Stop")
         self.stop_button.setEnabled(False)
@@ -148,8 +278,11 @@ class Ui_MainWindow(QtGui.QMainWindow):
         self.addDevice.setEnabled(False)
 
         # Begin threaded read of device
-        self.get_thread = getDataThread(self.tracking)
-        self.connect(self.get_thread, QtCore.SIGNAL("get_tracked_data(QString)"), self.update_Data)
+        self.data_model.clear()
+        self.path.clear()
+        self.speed.clear()
+        self.get_thread = getDataThread(self.tracking, self.path, self.speed)
+        self.connect(self.get_thread, QtCore.SIGNAL("get_tracked_data(PyQt_PyObject)"), self.update_Data)
         self.get_thread.start()
 
     def removeWrapper(self):
@@ -163,10 +296,11 @@ class Ui_MainWindow(QtGui.QMainWindow):
         self.addDevice.setEnabled(True)
         QtGui.QMessageBox.question(self, 'Success', "Device disconnected!", QtGui.QMessageBox.Ok)
 
-    def update_Data(self, data):
-        ''' Post data to GUI '''
+    def update_Data(self, rows):
+        ''' Post a batch of data to GUI '''
 
-        self.data_list.insertItem(0, data)
+        self.data_model.add_rows(rows)
+        self.plot.update()
 
     def errorHandler(self, ret):
         ''' Handle device attachment errors on frontend '''
@@ -183,11 +317,19 @@ class Ui_MainWindow(QtGui.QMainWindow):
 
 
 class getDataThread(QtCore.QThread):
-    ''' Read and display device data via modified PyQt thread'''
+    ''' Read and display device data via modified PyQt thread. Movements
+        are collected and sent to the GUI in one batch per display
+        refresh, so the GUI's work does not grow with the report rate.
+        Every movement is added to the plot buffers, if given '''
 
-    def __init__(self, device):
+    def __init__(self, device, path=None, speed=None, refresh=REFRESH_RATE, capacity=LIST_CAPACITY):
         QtCore.QThread.__init__(self)
         self.device = device
+        self.path = path                # Path_Trace to fill
+        self.speed = speed              # Speed_Trace to fill
+        self.period = 1.0 / refresh     # Seconds between updates
+        self.capacity = capacity        # Rows the GUI can show
+        self.last = None                # Time of the previous movement
 
     def __del__(self):
         self.wait()
@@ -196,15 +338,40 @@ class getDataThread(QtCore.QThread):
         ''' Read the device and update the GUI '''
 
         self.device.read(gui=1)
-        while(1):
-            try:
-                if(self.device.movements.empty() is False):
-                    data = self.device.get_movement(False, 2)
-                    if(data is not None):
-                        self.emit(QtCore.SIGNAL('get_tracked_data(QString)'), str(data))
-            except:
+
+        # Ends when the read is stopped and the buffer is empty
+        while(self.device.reading or not self.device.movements.empty()):
+            deadline = time.time() + self.period
+
+            # Sleep while the device is idle, then collect until the refresh
+            movements = self.device.movements.get_many(None, True, self.period)
+            time.sleep(max(0, deadline - time.time()))
+            movements += self.device.movements.get_many(None, False)
+
+            if(len(movements) == 0):
                 continue
 
+            self.add_plot(movements)
+
+            # Only rows that fit in the list are formatted
+            rows = [str(movement.get_data()) for movement in movements[-self.capacity:]]
+            self.emit(QtCore.SIGNAL('get_tracked_data(PyQt_PyObject)'), rows)
+
+    def add_plot(self, movements):
+        ''' Add movements to the path and their speed in counts per
+            second to the speed trace '''
+
+        for movement in movements:
+            d_x, d_y = movement.get_delta()
+
+            if(self.path is not None):
+                self.path.add(d_x, d_y)
+
+            if(self.speed is not None and self.last is not None and movement.time > self.last):
+                self.speed.add(movement.time, math.hypot(d_x, d_y) / (movement.time - self.last))
+
+            self.last = movement.time
+
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
 except AttributeError:
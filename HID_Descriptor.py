@@ -0,0 +1,369 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: HID report descriptor parsing. The descriptor a mouse
+    gives when it is claimed says where its buttons, X and Y movement
+    and wheel are in each input report, how wide they are and whether
+    they are signed. parse_layout() turns it into a Report_Layout that
+    decodes a report with one precompiled struct unpack when the
+    fields are byte aligned, and by extracting bits otherwise.
+    pack_layout() and unpack_layout() store a layout in the fixed size
+    LAYOUT entry used by session files and streams.
+
+    Version: Python 2.7 '''
+
+from collections import namedtuple
+import struct
+
+# Item types
+MAIN = 0
+GLOBAL = 1
+LOCAL = 2
+
+# Main item tags
+INPUT = 0x8
+
+# Global item tags
+USAGE_PAGE = 0x0
+LOGICAL_MINIMUM = 0x1
+LOGICAL_MAXIMUM = 0x2
+REPORT_SIZE = 0x7
+REPORT_ID = 0x8
+REPORT_COUNT = 0x9
+PUSH = 0xA
+POP = 0xB
+
+# Local item tags
+USAGE = 0x0
+USAGE_MINIMUM = 0x1
+USAGE_MAXIMUM = 0x2
+
+# Usages
+GENERIC_DESKTOP = 0x01
+BUTTON = 0x09
+X = 0x30
+Y = 0x31
+WHEEL = 0x38
+
+# One input field. offset is in bits from the start of the report data,
+# after the report ID
+Field = namedtuple('Field', ['page', 'usage', 'offset', 'size', 'minimum', 'maximum'])
+
+# Struct codes for byte aligned fields by (bytes, signed)
+CODES = {(1, False): 'B', (2, False): 'H', (4, False): 'I',
+         (1, True): 'b', (2, True): 'h', (4, True): 'i'}
+
+# Stored layout: present flag, report ID, data length in bytes, then
+# the offset, size, minimum and maximum of the buttons, X, Y and wheel.
+# Absent fields have a size of 0
+LAYOUT = struct.Struct('<BBH16i')
+
+# (page, usage) of the stored fields in order
+LAYOUT_USAGES = ((BUTTON, 0), (GENERIC_DESKTOP, X), (GENERIC_DESKTOP, Y), (GENERIC_DESKTOP, WHEEL))
+
+# Movements are scaled to speeds like one byte reports, so wide fields
+# give the same speed for the same movement
+SPEED_RANGE = 127
+
+def item_value(data, signed):
+    ''' Return the little endian value of an item's data '''
+
+    value = 0
+    for index, byte in enumerate(data):
+        value |= byte << (8 * index)
+
+    if(signed and len(data) > 0 and value & (1 << (8 * len(data) - 1))):
+        value -= 1 << (8 * len(data))
+
+    return value
+
+def parse_items(descriptor):
+    ''' Yield the (type, tag, data) of each short item '''
+
+    position = 0
+
+    while(position < len(descriptor)):
+        prefix = descriptor[position]
+
+        # Long items are reserved and carry nothing a mouse uses
+        if(prefix == 0xFE):
+            size = descriptor[position + 1] if position + 1 < len(descriptor) else 0
+            position += 3 + size
+            continue
+
+        size = (0, 1, 2, 4)[prefix & 0x3]
+        yield (prefix >> 2) & 0x3, prefix >> 4, descriptor[position + 1:position + 1 + size]
+        position += 1 + size
+
+def parse_reports(descriptor):
+    ''' Return the input reports of a descriptor as a list of
+        (report ID, length in bits, fields) in descriptor order. The
+        report ID is 0 if the device does not use IDs '''
+
+    state = {"page": 0, "minimum": 0, "maximum": 0, "size": 0, "count": 0, "id": 0}
+    stack = []                      # Pushed global states
+    usages = []                     # (page, usage) of the next main item
+    usage_range = [None, None]      # Usage minimum and maximum
+
+    reports = {}                    # Report ID -> [length in bits, fields]
+    order = []                      # Report IDs in descriptor order
+
+    for item_type, tag, data in parse_items(bytearray(descriptor)):
+        if(item_type == GLOBAL):
+            if(tag == USAGE_PAGE):
+                state["page"] = item_value(data, False)
+            elif(tag == LOGICAL_MINIMUM):
+                state["minimum"] = item_value(data, True)
+            elif(tag == LOGICAL_MAXIMUM):
+                # The maximum is only negative when the minimum is
+                state["maximum"] = item_value(data, state["minimum"] < 0)
+            elif(tag == REPORT_SIZE):
+                state["size"] = item_value(data, False)
+            elif(tag == REPORT_COUNT):
+                state["count"] = item_value(data, False)
+            elif(tag == REPORT_ID):
+                state["id"] = item_value(data, False)
+            elif(tag == PUSH):
+                stack.append(dict(state))
+            elif(tag == POP and len(stack) > 0):
+                state = stack.pop()
+
+        elif(item_type == LOCAL):
+            value = item_value(data, False)
+
+            # Four byte usages carry their own page
+            page = value >> 16 if len(data) == 4 else None
+
+            if(tag == USAGE):
+                usages.append((page, value & 0xFFFF))
+            elif(tag == USAGE_MINIMUM):
+                usage_range[0] = (page, value & 0xFFFF)
+            elif(tag == USAGE_MAXIMUM):
+                usage_range[1] = (page, value & 0xFFFF)
+
+        elif(item_type == MAIN):
+            if(tag == INPUT):
+                if(state["id"] not in reports):
+                    reports[state["id"]] = [0, []]
+                    order.append(state["id"])
+
+                report = reports[state["id"]]
+                flags = item_value(data, False)
+
+                # Constant fields are padding and array fields hold
+                # indices rather than values
+                variable = not flags & 0x1 and flags & 0x2
+
+                for index in range(state["count"]):
+                    usage = field_usage(usages, usage_range, index)
+
+                    if(variable and usage is not None):
+                        page = state["page"] if usage[0] is None else usage[0]
+                        report[1].append(Field(page, usage[1], report[0], state["size"],
+                                               state["minimum"], state["maximum"]))
+
+                    report[0] += state["size"]
+
+            # Local items only apply to the next main item
+            usages = []
+            usage_range = [None, None]
+
+    return [(report_id, reports[report_id][0], reports[report_id][1]) for report_id in order]
+
+def field_usage(usages, usage_range, index):
+    ''' Return the (page, usage) of the field at index of a main item '''
+
+    if(len(usages) > 0):
+        return usages[min(index, len(usages) - 1)]
+
+    if(usage_range[0] is not None and usage_range[1] is not None):
+        return (usage_range[0][0], min(usage_range[0][1] + index, usage_range[1][1]))
+
+    return None
+
+def parse_layout(descriptor):
+    ''' Return the Report_Layout of the first input report with X and
+        Y movement, or None if the descriptor has none '''
+
+    if(descriptor is None):
+        return None
+
+    for report_id, length, fields in parse_reports(descriptor):
+        found = dict(((field.page, field.usage), field) for field in reversed(fields))
+
+        x = found.get((GENERIC_DESKTOP, X))
+        y = found.get((GENERIC_DESKTOP, Y))
+
+        if(x is None or y is None):
+            continue
+
+        # Buttons are consecutive one bit fields
+        buttons = [field for field in fields if field.page == BUTTON]
+        if(len(buttons) > 0):
+            buttons = Field(BUTTON, 0, buttons[0].offset,
+                            buttons[-1].offset + buttons[-1].size - buttons[0].offset, 0, 1)
+        else:
+            buttons = None
+
+        return Report_Layout(report_id, (length + 7) // 8, buttons, x, y,
+                             found.get((GENERIC_DESKTOP, WHEEL)))
+
+    return None
+
+def pack_layout(layout):
+    ''' Return a Report_Layout, or None, as a LAYOUT entry '''
+
+    if(layout is None):
+        return LAYOUT.pack(0, 0, 0, *([0] * 16))
+
+    values = []
+    for field in (layout.buttons, layout.x, layout.y, layout.wheel):
+        if(field is None):
+            values.extend((0, 0, 0, 0))
+        else:
+            values.extend((field.offset, field.size, field.minimum, field.maximum))
+
+    return LAYOUT.pack(1, layout.report_id, layout.size - layout.start, *values)
+
+def unpack_layout(data, offset=0):
+    ''' Return the Report_Layout of a LAYOUT entry, or None '''
+
+    values = LAYOUT.unpack_from(data, offset)
+    if(values[0] == 0):
+        return None
+
+    fields = []
+    for index, (page, usage) in enumerate(LAYOUT_USAGES):
+        field_offset, size, minimum, maximum = values[3 + 4 * index:7 + 4 * index]
+        fields.append(Field(page, usage, field_offset, size, minimum, maximum) if size else None)
+
+    return Report_Layout(values[1], values[2], *fields)
+
+class Report_Layout(object):
+    ''' Where the mouse fields are in an input report.
+
+        report_id = ID of the report, 0 if the device does not use IDs
+        size = length of the report data in bytes, excluding the ID
+        buttons, x, y, wheel = Field of each value, or None if absent '''
+
+    def __init__(self, report_id, size, buttons, x, y, wheel):
+        self.report_id = report_id
+        self.buttons = buttons
+        self.x = x
+        self.y = y
+        self.wheel = wheel
+
+        # Fields are offset past the report ID
+        self.start = 1 if report_id else 0
+        self.prefix = struct.pack('B', report_id)   # Leading byte of matching reports
+        self.size = size + self.start       # Report length in bytes
+
+        # Largest movement, used to scale speeds. Wider fields are
+        # scaled like one byte fields
+        self.x_max = min(max(abs(x.minimum), abs(x.maximum)), SPEED_RANGE) or 1
+        self.y_max = min(max(abs(y.minimum), abs(y.maximum)), SPEED_RANGE) or 1
+
+        self.decode = self.compile()
+
+    def matches(self, report):
+        ''' Return True if a report, as bytes, has this layout '''
+
+        return (len(report) >= self.size and
+                (self.report_id == 0 or report[:1] == self.prefix))
+
+    def compile(self):
+        ''' Build the decoder. Returns a function taking the report as
+            bytes and returning (buttons, x, y, wheel) '''
+
+        fields = [self.buttons, self.x, self.y, self.wheel]
+        parts = []      # (byte offset, struct code, field index)
+
+        for index, field in enumerate(fields):
+            if(field is None):
+                continue
+
+            offset = field.offset + 8 * self.start
+            width = 8
+            while(width < field.size):
+                width *= 2
+
+            # Buttons are unsigned and masked, values must fill their bytes
+            whole = field.size == width or index == 0
+            if(offset % 8 != 0 or width > 32 or not whole or
+               offset + width > 8 * self.size):
+                return self.compile_bits()
+
+            parts.append((offset // 8, CODES[(width // 8, field.minimum < 0 and index != 0)], index))
+
+        parts.sort()
+
+        # Fields sharing bytes cannot be unpacked together
+        end = 0
+        code = "<"
+        for byte, field_code, index in parts:
+            if(byte < end):
+                return self.compile_bits()
+            if(byte > end):
+                code += "%dx" % (byte - end)
+            code += field_code
+            end = byte + struct.calcsize("<" + field_code)
+
+        unpack = struct.Struct(code).unpack_from
+        positions = dict((index, position) for position, (byte, field_code, index) in enumerate(parts))
+
+        b = positions.get(0)
+        x = positions[1]
+        y = positions[2]
+        w = positions.get(3)
+        mask = (1 << self.buttons.size) - 1 if self.buttons is not None else 0
+
+        # Specialize on which optional fields are present
+        if(b is not None and w is not None):
+            def decode(data):
+                values = unpack(data)
+                return (values[b] & mask, values[x], values[y], values[w])
+        elif(b is not None):
+            def decode(data):
+                values = unpack(data)
+                return (values[b] & mask, values[x], values[y], 0)
+        elif(w is not None):
+            def decode(data):
+                values = unpack(data)
+                return (0, values[x], values[y], values[w])
+        else:
+            def decode(data):
+                values = unpack(data)
+                return (0, values[x], values[y], 0)
+
+        return decode
+
+    def compile_bits(self):
+        ''' Build a decoder for fields that are not byte aligned '''
+
+        fields = [(field.offset + 8 * self.start, field.size, field.minimum < 0 and index != 0)
+                  if field is not None else None
+                  for index, field in enumerate([self.buttons, self.x, self.y, self.wheel])]
+        size = self.size
+
+        def extract(value, field):
+            if(field is None):
+                return 0
+
+            offset, width, signed = field
+            result = (value >> offset) & ((1 << width) - 1)
+
+            if(signed and result & (1 << (width - 1))):
+                result -= 1 << width
+
+            return result
+
+        def decode(data):
+            value = 0
+            for index, byte in enumerate(bytearray(data[:size])):
+                value |= byte << (8 * index)
+
+            return tuple(extract(value, field) for field in fields)
+
+        return decode
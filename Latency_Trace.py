@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Latency histograms for the stages a report passes
+    through between the USB read returning and the consumer receiving
+    its movement. Latency_Histogram counts nanosecond latencies in log
+    spaced buckets with 8 buckets per power of two, so recording is a
+    few integer operations and percentiles are within 12.5%.
+    Latency_Tracer keeps one histogram per stage for one device.
+
+    Version: Python 2.7 '''
+
+SUB_BITS = 3                # Buckets per power of two, as a power of two
+SUB = 1 << SUB_BITS
+BUCKETS = 64 * SUB          # Enough for any 64 bit latency
+
+# Stages, in the order a report passes through them
+STAGES = ("Decode",     # USB read returned -> movement built
+          "Enqueue",    # Movement built -> stored in the buffer
+          "Stages",     # Stored -> pipeline stages written
+          "Queue",      # Movement built -> taken by the consumer
+          "Total",      # USB read returned -> taken by the consumer
+          "Consumer")   # Consumer's time between taking movements
+
+def bucket_index(value):
+    ''' Return the bucket of a latency in nanoseconds '''
+
+    shift = value.bit_length() - SUB_BITS - 1
+    if(shift <= 0):
+        return max(value, 0)
+
+    return shift * SUB + (value >> shift)
+
+def bucket_limit(index):
+    ''' Return the largest latency counted in a bucket '''
+
+    shift = max(index // SUB - 1, 0)
+    return ((index - shift * SUB + 1) << shift) - 1
+
+class Latency_Histogram(object):
+    ''' Log bucketed histogram of latencies in nanoseconds '''
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS     # Latencies per bucket
+        self.count = 0                  # Latencies recorded
+        self.maximum = 0                # Largest latency recorded
+
+    def add(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        if(value > self.maximum):
+            self.maximum = value
+
+    def percentile(self, fraction):
+        ''' Return the latency below which fraction of the recorded
+            latencies fall, rounded up to its bucket's limit '''
+
+        if(self.count == 0):
+            return None
+
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if(count > 0 and seen >= rank):
+                return min(bucket_limit(index), self.maximum)
+
+        return self.maximum
+
+class Latency_Tracer(object):
+    ''' Histogram of each stage for one device. The reading thread
+        records the capture stages and the consumer records the rest,
+        so each histogram has a single writer and takes no lock '''
+
+    def __init__(self):
+        self.histograms = dict((stage, Latency_Histogram()) for stage in STAGES)
+        self.returned = None    # Time the consumer last took a movement
+
+    def captured(self, read, built, stored, written):
+        ''' Record the capture stages of a movement. Times are
+            nanosecond timestamps from monotonic_ns(). The movement
+            carries (read, built) in its trace attribute for the
+            consumer side '''
+
+        self.histograms["Decode"].add(built - read)
+        self.histograms["Enqueue"].add(stored - built)
+        self.histograms["Stages"].add(written - stored)
+
+    def taken(self, movements, now):
+        ''' Record the consumer stages of movements taken at now '''
+
+        for movement in movements:
+            trace = getattr(movement, 'trace', None)
+
+            # Movements from capture processes are not traced
+            if(trace is not None):
+                self.histograms["Queue"].add(now - trace[1])
+                self.histograms["Total"].add(now - trace[0])
+
+        self.returned = now
+
+    def started(self, now):
+        ''' Record the consumer's time since it last took a movement.
+            Waits that return nothing are not counted again '''
+
+        if(self.returned is not None):
+            self.histograms["Consumer"].add(now - self.returned)
+            self.returned = None
+
+    def get_stats(self):
+        ''' Return (stage, count, p50, p99, p99.9, max) for each stage.
+            Times are in microseconds '''
+
+        def micro(value):
+            return None if value is None else value / 1000.0
+
+        stats = []
+        for stage in STAGES:
+            histogram = self.histograms[stage]
+            stats.append((stage, histogram.count,
+                          micro(histogram.percentile(0.5)),
+                          micro(histogram.percentile(0.99)),
+                          micro(histogram.percentile(0.999)),
+                          micro(histogram.maximum if histogram.count else None)))
+
+        return stats
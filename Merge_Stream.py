@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Time ordered merge of the movements of several
+    devices. Movements are merged by capture time with a heap. A
+    movement is released once every device has a later movement
+    pending, or once it is older than the reordering window, so a
+    movement read late by another device's thread can still be placed
+    before it.
+
+    Version: Python 2.7 '''
+
+import heapq
+import select
+from Report_Timing import monotonic
+
+class Merged_Stream(object):
+    ''' Iterator over the movements of several devices in capture
+        time order.
+
+        window = seconds a movement is held back waiting for earlier
+                 movements from devices that have nothing pending
+        label, verbosity = representation, as in USB_Mouse.get_movement.
+                 A verbosity of 0 gives Mouse_Movement objects
+
+        The stream ends once no device is being read and every
+        movement has been released. '''
+
+    def __init__(self, devices, window=0.005, label=False, verbosity=0):
+        self.devices = devices                  # USB_Mouse objects to merge
+        self.window = window                    # Reordering window in seconds
+        self.label = label
+        self.verbosity = verbosity
+
+        self.heap = []                          # (time, sequence, device index, movement)
+        self.pending = [0] * len(devices)       # Movements held per device
+        self.sequence = 0                       # Breaks ties in capture order
+
+    def fill(self):
+        ''' Move every buffered movement onto the heap '''
+
+        for index, device in enumerate(self.devices):
+            for movement in device.movements.get_many(None, False):
+                heapq.heappush(self.heap, (movement.time, self.sequence, index, movement))
+                self.sequence += 1
+                self.pending[index] += 1
+
+    def delay(self):
+        ''' Return the seconds until the oldest held movement can be
+            released, or None if nothing is held '''
+
+        if(len(self.heap) == 0):
+            return None
+
+        # Every device has a later movement, so nothing earlier can arrive
+        if(all(self.pending)):
+            return 0
+
+        return max(0, self.heap[0][0] + self.window - monotonic())
+
+    def pop(self):
+        ''' Release the oldest held movement as (device index, movement) '''
+
+        timestamp, sequence, index, movement = heapq.heappop(self.heap)
+        self.pending[index] -= 1
+
+        return index, movement
+
+    def wait(self, timeout):
+        ''' Sleep until a device has data or the timeout passes '''
+
+        select.select([device.movements for device in self.devices], [], [], timeout)
+
+    def drain(self):
+        ''' Return every movement that can be released now, in order,
+            as (device index, movement) pairs. Does not wait '''
+
+        self.fill()
+
+        released = []
+        while(self.delay() == 0):
+            released.append(self.pop())
+
+        return released
+
+    def merge(self):
+        ''' Yield (device index, movement) pairs in order, and None
+            each time the stream wakes without releasing anything '''
+
+        while(True):
+            released = self.drain()
+
+            for item in released:
+                yield item
+
+            if(len(released) > 0):
+                continue
+
+            delay = self.delay()
+
+            if(delay is None and not any(device.reading for device in self.devices)):
+                self.fill()
+                if(len(self.heap) == 0):
+                    return
+
+                # Nothing more will arrive, so release the rest
+                while(len(self.heap) > 0):
+                    yield self.pop()
+                return
+
+            yield None
+            self.wait(0.5 if delay is None else delay)
+
+    def format(self, index, movement):
+        return self.devices[index].format_movement(movement, self.label, self.verbosity)
+
+    def __iter__(self):
+        for item in self.merge():
+            if(item is not None):
+                yield self.format(*item)
+
+    def slots(self, period):
+        ''' Yield (slot time, samples) for consecutive time slots of
+            period seconds. samples holds the latest movement of each
+            device in the slot, or None if it had none. Slots where no
+            device moved are skipped '''
+
+        current = None
+        samples = None
+
+        for item in self.merge():
+            # Flush the slot once nothing earlier can still arrive
+            if(current is not None and (item is not None and item[1].time >= current + period or
+                                        item is None and monotonic() - self.window >= current + period)):
+                yield (current, samples)
+                current = None
+
+            if(item is None):
+                continue
+
+            index, movement = item
+
+            if(current is None):
+                current = (movement.time // period) * period
+                samples = [None] * len(self.devices)
+
+            samples[index] = self.format(index, movement)
+
+        if(current is not None):
+            yield (current, samples)
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Incremental motion state for a device. Integrates the
+    signed movement of each report into a position and keeps
+    instantaneous and windowed velocity and acceleration. Each report
+    costs O(1), and the current state is published as one tuple so
+    it can be read from any thread without a lock.
+
+    Units are report counts and seconds. X is positive to the right
+    and Y is positive upward.
+
+    Version: Python 2.7 '''
+
+from collections import deque
+
+class Motion_Accumulator(object):
+    ''' Pipeline stage that tracks the motion of a device.
+
+        window = seconds of history used for windowed velocity and
+                 acceleration. A device that sends nothing for a
+                 window is reported as stationary. '''
+
+    def __init__(self, window=0.05, clock=None):
+        self.window = window        # Seconds of history
+        self.clock = clock          # Time source for idle detection
+
+        self.x = 0                  # Cumulative displacement
+        self.y = 0
+        self.last = None            # Time of the previous report
+        self.history = deque()      # (time, x, y, vx, vy) within the window
+
+        # (time, x, y, vx, vy, window vx, window vy, ax, ay)
+        self.state = (None, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+    def write(self, device, movement):
+        ''' Add one movement '''
+
+        d_x, d_y = movement.get_delta()
+        now = movement.time
+
+        self.x += d_x
+        self.y += d_y
+
+        # Instantaneous velocity from the previous report
+        if(self.last is not None and now > self.last):
+            v_x = d_x / (now - self.last)
+            v_y = d_y / (now - self.last)
+        else:
+            v_x = v_y = 0.0
+        self.last = now
+
+        # Drop history older than the window, keeping one sample at or
+        # before its start as the reference point
+        history = self.history
+        while(len(history) > 1 and history[1][0] <= now - self.window):
+            history.popleft()
+
+        if(len(history) > 0 and now > history[0][0]):
+            span = now - history[0][0]
+            w_x = (self.x - history[0][1]) / span
+            w_y = (self.y - history[0][2]) / span
+            a_x = (w_x - history[0][3]) / span
+            a_y = (w_y - history[0][4]) / span
+        else:
+            w_x = w_y = a_x = a_y = 0.0
+
+        history.append((now, self.x, self.y, w_x, w_y))
+
+        # Publish atomically
+        self.state = (now, self.x, self.y, v_x, v_y, w_x, w_y, a_x, a_y)
+
+    def get_state(self):
+        ''' Return the current motion as a list of tuples '''
+
+        now, x, y, v_x, v_y, w_x, w_y, a_x, a_y = self.state
+
+        # Mice send nothing while stationary
+        if(self.clock is not None and now is not None and self.clock() - now > self.window):
+            v_x = v_y = w_x = w_y = a_x = a_y = 0.0
+
+        return [("Time", now), ("Position", (x, y)),
+                ("Velocity", (v_x, v_y)),
+                ("Window_Velocity", (w_x, w_y)),
+                ("Acceleration", (a_x, a_y))]
+
+    def reset(self):
+        ''' Return to the origin with no motion '''
+
+        self.__init__(self.window, self.clock)
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Vectorized decoding of many mouse reports at once.
+    Produces the same directions and speeds as Mouse_Movement, but
+    analyzes an (N, 8) array of raw reports in one pass with NumPy.
+    Reports of devices with a HID report layout are decoded like
+    HID_Movement, from an (N, size) array.
+
+    Version: Python 2.7 '''
+
+import numpy as np
+
+# Direction names indexed by direction code. Code 1 is a value
+# below the median and code 2 a value above it, before reversal
+LR_DIRS = ("None", "Right", "Left")
+UD_DIRS = ("None", "Down", "Up")
+
+def decode_axis(values, maximum, reverse):
+    ''' Decode one column of raw values into direction codes and
+        speeds, mirroring Mouse_Movement.analyze_dir/analyze_spd '''
+
+    maximum = maximum + 1
+    median = maximum // 2
+    scale = float(median - 1)
+
+    values = values.astype(np.int64)
+    below = (values > 0) & (values < median)
+    above = (values > 0) & (values > median)
+
+    codes = np.zeros(len(values), dtype=np.int8)
+    speeds = np.zeros(len(values), dtype=np.int64)
+
+    # Reverse movement if flag is set
+    codes[below] = 2 if reverse == 1 else 1
+    codes[above] = 1 if reverse == 1 else 2
+
+    # Same operation order as the scalar path so results match exactly
+    speeds[below] = (values[below] / scale * 100).astype(np.int64)
+    speeds[above] = ((maximum - values[above]) / scale * 100).astype(np.int64)
+
+    return codes, speeds
+
+def decode_reports(reports, lr_col=1, ud_col=2, lr_max=255, ud_max=255,
+                   rev_lr=0, rev_ud=0):
+    ''' Decode an (N, 8) array of raw reports. Takes the same
+        configuration as Mouse_Movement and returns a tuple of
+        (lr_dir, ud_dir, lr_spd, ud_spd) arrays. Direction codes
+        index LR_DIRS and UD_DIRS '''
+
+    reports = np.asarray(reports)
+
+    lr_dir, lr_spd = decode_axis(reports[:, lr_col], lr_max, rev_lr)
+    ud_dir, ud_spd = decode_axis(reports[:, ud_col], ud_max, rev_ud)
+
+    return lr_dir, ud_dir, lr_spd, ud_spd
+
+def delta_axis(values, maximum, reverse):
+    ''' Decode one column of raw values into signed counts, with values
+        below the median positive, mirroring Mouse_Movement.get_delta '''
+
+    maximum = maximum + 1
+    median = maximum // 2
+
+    values = values.astype(np.int64)
+    deltas = np.zeros(len(values), dtype=np.int64)
+
+    below = (values > 0) & (values < median)
+    above = values > median
+
+    deltas[below] = values[below]
+    deltas[above] = values[above] - maximum
+
+    # Reverse movement if flag is set
+    if(reverse == 1):
+        deltas = -deltas
+
+    return deltas
+
+def decode_deltas(reports, lr_col=1, ud_col=2, lr_max=255, ud_max=255,
+                  rev_lr=0, rev_ud=0):
+    ''' Return the signed (x, y) movement arrays of an (N, 8) array of
+        raw reports, with x positive to the right and y positive
+        upward '''
+
+    reports = np.asarray(reports)
+
+    d_x = delta_axis(reports[:, lr_col], lr_max, rev_lr)
+    d_y = -delta_axis(reports[:, ud_col], ud_max, rev_ud)
+
+    return d_x, d_y
+
+def layout_field(reports, field, start, signed):
+    ''' Extract one Report_Layout field from an (N, size) array of raw
+        reports, mirroring Report_Layout.decode '''
+
+    values = np.zeros(len(reports), dtype=np.int64)
+    if(field is None):
+        return values
+
+    offset = field.offset + 8 * start
+
+    # Gather the bytes holding the field, then shift and mask it out
+    first = offset // 8
+    for index in range(first, (offset + field.size - 1) // 8 + 1):
+        values |= reports[:, index].astype(np.int64) << (8 * (index - first))
+
+    values = (values >> (offset % 8)) & ((1 << field.size) - 1)
+
+    if(signed):
+        values[values >= 1 << (field.size - 1)] -= 1 << field.size
+
+    return values
+
+def layout_deltas(reports, layout, rev_lr=0, rev_ud=0, **config):
+    ''' Return the signed (x, y) movement arrays of an (N, size) array
+        of raw reports with a Report_Layout, mirroring
+        HID_Movement.get_delta. The column and range parameters are not
+        used '''
+
+    reports = np.asarray(reports)
+
+    # Reports count y downward
+    d_x = layout_field(reports, layout.x, layout.start, layout.x.minimum < 0)
+    d_y = -layout_field(reports, layout.y, layout.start, layout.y.minimum < 0)
+
+    # Reverse movement if flag is set
+    if(rev_lr == 1):
+        d_x = -d_x
+    if(rev_ud == 1):
+        d_y = -d_y
+
+    return d_x, d_y
+
+def decode_layout(reports, layout, rev_lr=0, rev_ud=0, **config):
+    ''' Decode an (N, size) array of raw reports with a Report_Layout.
+        Returns (lr_dir, ud_dir, lr_spd, ud_spd) arrays like
+        decode_reports, mirroring HID_Movement.decode. The column and
+        range parameters are not used '''
+
+    d_x, d_y = layout_deltas(reports, layout, rev_lr, rev_ud)
+
+    lr_dir = np.where(d_x > 0, 1, np.where(d_x < 0, 2, 0)).astype(np.int8)
+    ud_dir = np.where(d_y > 0, 2, np.where(d_y < 0, 1, 0)).astype(np.int8)
+
+    lr_spd = np.minimum(100, (np.abs(d_x) / float(layout.x_max) * 100).astype(np.int64))
+    ud_spd = np.minimum(100, (np.abs(d_y) / float(layout.y_max) * 100).astype(np.int64))
+
+    return lr_dir, ud_dir, lr_spd, ud_spd
+
+class Movement_Batch(object):
+    ''' A decoded batch of movements from one device. If layout is
+        set the reports are layout.size bytes long and decoded with it '''
+
+    def __init__(self, device, reports, layout=None, **config):
+        # Raw data, from a list of reports or concatenated report bytes
+        if(isinstance(reports, (bytes, bytearray))):
+            reports = np.frombuffer(reports, dtype=np.uint8)
+
+        size = 8 if layout is None else layout.size
+
+        self.device = device                                                # Device
+        self.raw = np.asarray(reports, dtype=np.uint8).reshape(-1, size)    # Raw data
+
+        if(layout is None):
+            decoded = decode_reports(self.raw, **config)
+        else:
+            decoded = decode_layout(self.raw, layout, **config)
+
+        self.left_right = decoded[0]        # Movement direction codes
+        self.up_down = decoded[1]
+        self.left_right_spd = decoded[2]    # Movement speeds
+        self.up_down_spd = decoded[3]
+
+    def __len__(self):
+        return len(self.raw)
+
+    def get_raw(self, label=False):
+        ''' Return raw data as an (N, 8) array, (N, size) with a layout '''
+
+        if(label is False):
+            return self.raw
+        else:
+            return("Device: " + str(self.device), self.raw)
+
+    def get_dir(self, label=False):
+        ''' Return a list of movement direction tuples '''
+
+        dirs = [(LR_DIRS[lr], UD_DIRS[ud])
+                for lr, ud in zip(self.left_right, self.up_down)]
+
+        if(label is False):
+            return dirs
+        else:
+            return("Device: " + str(self.device), dirs)
+
+    def get_spd(self, label=False):
+        ''' Return a list of movement speed tuples '''
+
+        spds = list(zip(self.left_right_spd.tolist(), self.up_down_spd.tolist()))
+
+        if(label is False):
+            return spds
+        else:
+            return("Device: " + str(self.device), spds)
+
+    def get_data(self, label=False):
+        ''' Return a list of movement data, one entry per report in
+            the same format as Mouse_Movement.get_data '''
+
+        data = [[(direc[0], speed[0]), (direc[1], speed[1])]
+                for direc, speed in zip(self.get_dir(), self.get_spd())]
+
+        if(label is False):
+            return data
+        else:
+            return("Device: " + str(self.device), data)
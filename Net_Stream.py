@@ -0,0 +1,378 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Binary network streaming of movements. Movement_Publisher
+    is a pipeline stage that packs movements into fixed size frames and
+    sends them in batches over UDP or TCP from a background thread, so
+    the reading threads never wait on the network. Movement_Subscriber
+    receives the batches and rebuilds the movements.
+
+    Message layout (little endian):
+        header   magic, version, kind, frame count, sequence number,
+                 report length
+        frames   devices message: one entry per device: number, vendor
+                 ID, product ID, the six Mouse_Movement parameters and
+                 the HID report layout, as in session files
+                 movements message: time (float64), raw report
+                 (report length bytes), device index (uint16)
+
+    Reports are 8 bytes, or the longest report a published device's
+    layout describes.
+
+    A devices message is sent when a publisher starts and, over UDP,
+    every announce seconds so late subscribers learn the devices.
+    Sequence numbers let UDP subscribers count lost messages.
+
+    Version: Python 2.7 '''
+
+from threading import Thread, Event, Lock
+import select
+import socket
+import struct
+import time
+from HID_Descriptor import LAYOUT
+from Ring_Buffer import Ring_Buffer, DROP_OLDEST
+from Session_Recorder import DEVICE, pack_device, unpack_device, report_size
+
+MAGIC = b'MVNT'
+VERSION = 2
+
+HEADER = struct.Struct('<4sBBHIH2x')
+ENTRY_SIZE = DEVICE.size + LAYOUT.size     # Devices message entry
+
+# Message kinds
+DEVICES = 0
+MOVEMENTS = 1
+
+# Frames per message. 64 movement frames of 8 byte reports fit in one
+# Ethernet frame
+BATCH = 64
+
+# Largest UDP payload over IPv4
+MAX_DATAGRAM = 65507
+
+def frame_struct(size):
+    ''' Return the movement frame of reports of size bytes '''
+
+    return struct.Struct('<d%dsH' % size)
+
+class Movement_Publisher(object):
+    ''' Pipeline stage that sends the movements of a set of devices.
+
+        address = (host, port) of the subscriber
+        protocol = "udp" or "tcp"
+        batch = movement frames per message, over UDP at most as many
+                as fit in one datagram
+        latency = seconds a movement may wait for its batch to fill
+        announce = seconds between devices messages over UDP
+        backlog = messages kept while the network is slower than the
+                  devices, the oldest are dropped beyond it '''
+
+    def __init__(self, address, devices, protocol="udp", batch=BATCH, latency=0.01,
+                 announce=1.0, backlog=1024):
+        if(protocol not in ("udp", "tcp")):
+            raise ValueError("Unknown protocol: " + str(protocol))
+
+        self.address = address          # Subscriber address
+        self.devices = list(devices)    # Devices published
+        self.indices = dict((id(device), index) for index, device in enumerate(self.devices))
+        self.size = report_size([device.layout for device in self.devices])    # Report length
+        self.frame = frame_struct(self.size)
+        self.protocol = protocol
+        self.batch = min(batch, 0xFFFF)
+        if(protocol == "udp"):
+            self.batch = min(self.batch, (MAX_DATAGRAM - HEADER.size) // self.frame.size)
+        self.latency = latency
+        self.announce = announce
+
+        self.pending = bytearray()      # Frames of the batch being filled
+        self.count = 0                  # Frames in the pending batch
+        self.lock = Lock()              # Devices are read by separate threads
+        self.messages = Ring_Buffer(backlog, DROP_OLDEST)   # Batches waiting to be sent
+        self.sequence = 0               # Number of the next message
+        self.sent = 0                   # Movements sent
+        self.errors = 0                 # Failed sends
+
+        if(protocol == "udp"):
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.socket = socket.create_connection(address)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.event = Event()
+        self.event.set()
+        self.thread = Thread(target=self.send_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, device, movement):
+        ''' Add one movement to the pending batch '''
+
+        frame = self.frame.pack(movement.time, movement.data, self.indices[id(device)])
+
+        with self.lock:
+            self.pending += frame
+            self.count += 1
+
+            if(self.count >= self.batch):
+                self.queue_batch()
+
+    def queue_batch(self):
+        ''' Hand the pending batch to the sending thread. The lock must
+            be held '''
+
+        if(self.count > 0):
+            self.messages.put((self.count, bytes(self.pending)))
+            del self.pending[:]
+            self.count = 0
+
+    def devices_message(self):
+        ''' Build the devices message '''
+
+        entries = [pack_device(device) for device in self.devices]
+
+        return self.message(DEVICES, len(entries), b''.join(entries))
+
+    def message(self, kind, count, body):
+        header = HEADER.pack(MAGIC, VERSION, kind, count, self.sequence & 0xFFFFFFFF, self.size)
+        self.sequence += 1
+        return header + body
+
+    def send(self, message):
+        ''' Send one message. Returns False if it could not be sent '''
+
+        try:
+            if(self.protocol == "udp"):
+                self.socket.sendto(message, self.address)
+            else:
+                self.socket.sendall(message)
+        except (socket.error, OSError):
+            self.errors += 1
+            return False
+
+        return True
+
+    def send_loop(self):
+        ''' Send batches as they fill, partial batches once they are
+            latency seconds old, and the devices until stopped '''
+
+        announced = None
+
+        while(True):
+            running = self.event.is_set()
+
+            if(announced is None or (self.protocol == "udp" and
+                                     time.time() - announced >= self.announce)):
+                # A TCP subscriber that is gone does not come back
+                if(not self.send(self.devices_message()) and self.protocol == "tcp"):
+                    return
+                announced = time.time()
+
+            batches = self.messages.get_many(None, running, self.latency)
+
+            # Partial batches are sent after waiting the latency
+            if(len(batches) == 0):
+                with self.lock:
+                    self.queue_batch()
+                batches = self.messages.get_many(None, False)
+
+            for count, frames in batches:
+                if(self.send(self.message(MOVEMENTS, count, frames))):
+                    self.sent += count
+                elif(self.protocol == "tcp"):
+                    return
+
+            if(not running):
+                return
+
+    def close(self):
+        ''' Detach from the devices, send what is pending and close the
+            socket '''
+
+        for device in self.devices:
+            device.remove_stage(self)
+
+        with self.lock:
+            self.queue_batch()
+
+        self.event.clear()
+        self.thread.join()
+        self.messages.close()
+        self.socket.close()
+
+class Movement_Subscriber(object):
+    ''' Receive movements sent by publishers. A background thread
+        rebuilds the movements into a buffer read like a device's.
+
+        port = port to listen on, 0 picks a free one
+        host = address to bind, localhost by default
+        protocol = "udp" or "tcp"
+        movement = class used to rebuild movements, Mouse_Movement by
+                   default. Devices with a HID report layout give
+                   HID_Movement objects '''
+
+    def __init__(self, port, host="127.0.0.1", protocol="udp", capacity=65536,
+                 policy=DROP_OLDEST, movement=None):
+        if(protocol not in ("udp", "tcp")):
+            raise ValueError("Unknown protocol: " + str(protocol))
+
+        # Imported here, USB_Device imports this module
+        from USB_Device import HID_Movement
+        if(movement is None):
+            from USB_Device import Mouse_Movement as movement
+
+        self.protocol = protocol
+        self.movement = movement
+        self.hid_movement = HID_Movement
+        self.movements = Ring_Buffer(capacity, policy)  # Received movements
+
+        self.devices = {}       # (source, index) -> (number, configuration, layout)
+        self.sequences = {}     # source -> next expected sequence number
+        self.received = 0       # Movements received
+        self.lost = 0           # Messages lost in transit
+        self.unknown = 0        # Movements from devices not yet announced
+
+        if(protocol == "udp"):
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind((host, port))
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((host, port))
+            self.socket.listen(8)
+        self.port = self.socket.getsockname()[1]    # Bound port
+
+        self.connections = {}   # TCP socket -> [source, unread bytes]
+
+        self.event = Event()
+        self.event.set()
+        self.thread = Thread(target=self.receive_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def receive_loop(self):
+        ''' Receive messages until closed '''
+
+        while(self.event.is_set()):
+            sockets = [self.socket] + list(self.connections)
+            readable = select.select(sockets, [], [], 0.5)[0]
+
+            for ready in readable:
+                if(self.protocol == "udp"):
+                    data, source = self.socket.recvfrom(65535)
+                    self.handle(source, data)
+
+                elif(ready is self.socket):
+                    connection, source = self.socket.accept()
+                    self.connections[connection] = [source, bytearray()]
+
+                else:
+                    self.receive_stream(ready)
+
+        for connection in self.connections:
+            connection.close()
+        self.connections = {}
+
+    def receive_stream(self, connection):
+        ''' Read from a TCP publisher and handle its complete messages '''
+
+        source, buff = self.connections[connection]
+
+        try:
+            data = connection.recv(65536)
+        except (socket.error, OSError):
+            data = b''
+
+        if(len(data) == 0):
+            connection.close()
+            del self.connections[connection]
+            return
+
+        buff += data
+
+        while(len(buff) >= HEADER.size):
+            magic, version, kind, count, sequence, length = HEADER.unpack_from(buff, 0)
+            size = HEADER.size + count * (ENTRY_SIZE if kind == DEVICES else frame_struct(length).size)
+
+            if(len(buff) < size):
+                break
+
+            self.handle(source, bytes(buff[:size]))
+            del buff[:size]
+
+    def handle(self, source, data):
+        ''' Handle one message '''
+
+        if(len(data) < HEADER.size):
+            return
+
+        magic, version, kind, count, sequence, length = HEADER.unpack_from(data, 0)
+        if(magic != MAGIC or version != VERSION):
+            return
+
+        # Count the messages skipped since the last one from this source
+        expected = self.sequences.get(source)
+        if(expected is not None and sequence != expected):
+            self.lost += (sequence - expected) & 0xFFFFFFFF
+        self.sequences[source] = (sequence + 1) & 0xFFFFFFFF
+
+        if(kind == DEVICES):
+            for index in range(count):
+                device = unpack_device(data, HEADER.size + index * ENTRY_SIZE)
+                self.devices[(source, index)] = (device["num"], device["config"], device["layout"])
+            return
+
+        frame = frame_struct(length)
+
+        movements = []
+        for index in range(count):
+            timestamp, report, device = frame.unpack_from(data, HEADER.size + index * frame.size)
+            known = self.devices.get((source, device))
+
+            if(known is None):
+                self.unknown += 1
+                continue
+
+            # Reports are cut back from the longest published length
+            layout = known[2]
+            if(layout is not None):
+                movements.append(self.hid_movement(known[0], report[:layout.size], layout,
+                                                   timestamp=timestamp, **known[1]))
+            else:
+                movements.append(self.movement(known[0], report[:8], timestamp=timestamp, **known[1]))
+
+        for movement in movements:
+            self.movements.put(movement)
+        self.received += len(movements)
+
+    def get_movement(self, timeout=0):
+        ''' Return the next movement, waiting up to timeout seconds
+            (forever if None). Returns None if none arrived '''
+
+        movements = self.movements.get_many(1, timeout != 0, timeout)
+        return movements[0] if movements else None
+
+    def get_movements(self, max_n=None, timeout=0):
+        ''' Return up to max_n received movements (all if None) '''
+
+        return self.movements.get_many(max_n, timeout != 0, timeout)
+
+    def __iter__(self):
+        ''' Yield movements until closed '''
+
+        while(self.event.is_set() or not self.movements.empty()):
+            for movement in self.movements.get_many(None, True, 0.5):
+                yield movement
+
+    def fileno(self):
+        ''' Readable while movements are waiting, for select() '''
+
+        return self.movements.fileno()
+
+    def close(self):
+        self.event.clear()
+        self.thread.join()
+        self.socket.close()
+        self.movements.close()
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Planar odometry from two mice mounted on a rigid
+    body. Each mouse measures the movement of its mounting point, so
+    the difference between the two gives the rotation of the body and
+    their mean gives its translation. Movements are grouped into short
+    time steps and each step is solved in closed form.
+
+    Positions are in the units of the mounting geometry and headings
+    in radians, counterclockwise from the body x axis. The body starts
+    at the origin with a heading of 0.
+
+    Version: Python 2.7 '''
+
+from threading import Lock
+import math
+
+# NumPy is only needed for batch odometry
+try:
+    import numpy as np
+    from Movement_Batch import decode_deltas, layout_deltas
+except ImportError:
+    np = None
+
+class Odometry(object):
+    ''' Pipeline stage that estimates the pose (x, y, theta) of a
+        body carrying two mice.
+
+        devices = the two USB_Mouse objects, or None for batch use only
+        positions = ((x, y), (x, y)) position of each mouse in the
+                    body frame
+        angles = rotation of each mouse's x axis from the body x axis
+                 in radians
+        resolution = counts per unit of distance, for both mice or
+                     one per mouse
+        period = seconds per step. Movements of both mice in the same
+                 step are solved together
+        configs = Mouse_Movement parameters of each mouse for batch
+                  use, taken from the devices if None
+        layouts = Report_Layout of each mouse (None for column
+                  decoding) for batch use, taken from the devices if
+                  None
+        clock = time source used to apply a step that has ended while
+                both mice are still '''
+
+    def __init__(self, devices, positions, angles=(0.0, 0.0), resolution=1.0,
+                 period=0.002, configs=None, clock=None, layouts=None):
+
+        if(not isinstance(resolution, (tuple, list))):
+            resolution = (resolution, resolution)
+
+        (x_0, y_0), (x_1, y_1) = positions
+
+        # Line between the mice and its squared length
+        self.base = (x_0 - x_1, y_0 - y_1)
+        self.length = self.base[0] ** 2 + self.base[1] ** 2
+        if(self.length == 0):
+            raise ValueError("The mice must be mounted at different positions")
+
+        self.center = ((x_0 + x_1) / 2.0, (y_0 + y_1) / 2.0)   # Midpoint of the mice
+
+        # Rotation and scale from each mouse's counts to the body frame
+        self.rotations = [(math.cos(angle) / scale, math.sin(angle) / scale)
+                          for angle, scale in zip(angles, resolution)]
+
+        self.period = period                # Seconds per step
+        self.clock = clock                  # Time source for idle steps
+        self.devices = [] if devices is None else list(devices)
+        self.indices = dict((id(device), index) for index, device in enumerate(self.devices))
+
+        if(configs is None):
+            configs = [device.movement_config for device in self.devices]
+        self.configs = configs              # Mouse_Movement parameters per mouse
+
+        if(layouts is None):
+            layouts = [device.layout for device in self.devices] or [None, None]
+        self.layouts = layouts              # Report_Layout per mouse
+
+        self.lock = Lock()                  # Mice are read by separate threads
+        self.step = None                    # Step holding the pending counts
+        self.pending = [0, 0, 0, 0]         # Counts of the step (x0, y0, x1, y1)
+        self.pose = (0.0, 0.0, 0.0)         # (x, y, theta) at the end of the last step
+
+        # (time, x, y, theta)
+        self.state = (None, 0.0, 0.0, 0.0)
+
+    def to_body(self, index, d_x, d_y):
+        ''' Rotate and scale counts of a mouse into the body frame '''
+
+        cos, sin = self.rotations[index]
+        return (cos * d_x - sin * d_y, sin * d_x + cos * d_y)
+
+    def solve(self, b_x0, b_y0, b_x1, b_y1):
+        ''' Return the body frame translation and rotation (t_x, t_y,
+            d_theta) of a step from the movement of each mouse. Works
+            on floats or NumPy arrays '''
+
+        # A rotation moves the mice in opposite directions across the
+        # line joining them
+        d_theta = ((b_x0 - b_x1) * -self.base[1] + (b_y0 - b_y1) * self.base[0]) / self.length
+
+        # The midpoint moves with the mean of the mice, less the rotation
+        t_x = (b_x0 + b_x1) / 2.0 + d_theta * self.center[1]
+        t_y = (b_y0 + b_y1) / 2.0 - d_theta * self.center[0]
+
+        return t_x, t_y, d_theta
+
+    def write(self, device, movement):
+        ''' Add one movement '''
+
+        index = self.indices[id(device)]
+        d_x, d_y = movement.get_delta()
+        step = movement.time // self.period
+
+        with self.lock:
+            if(step != self.step):
+                self.integrate()
+                self.step = step
+
+            self.pending[2 * index] += d_x
+            self.pending[2 * index + 1] += d_y
+
+    def integrate(self):
+        ''' Apply the pending counts as one step. The lock must be held '''
+
+        if(self.step is None):
+            return
+
+        d_x0, d_y0, d_x1, d_y1 = self.pending
+        self.pending = [0, 0, 0, 0]
+
+        t_x, t_y, d_theta = self.solve(*(self.to_body(0, d_x0, d_y0) + self.to_body(1, d_x1, d_y1)))
+
+        # Rotate into the world frame at the mid-step heading
+        x, y, theta = self.pose
+        heading = theta + d_theta / 2.0
+        x += math.cos(heading) * t_x - math.sin(heading) * t_y
+        y += math.sin(heading) * t_x + math.cos(heading) * t_y
+        theta += d_theta
+
+        self.pose = (x, y, theta)
+        self.state = (self.step * self.period, x, y, theta)
+        self.step = None
+
+    def get_pose(self):
+        ''' Return the current pose as a list of tuples '''
+
+        # Mice send nothing while stationary, so the last step may
+        # have ended without a later movement to apply it
+        if(self.clock is not None and self.step is not None):
+            with self.lock:
+                if(self.step is not None and self.clock() // self.period != self.step):
+                    self.integrate()
+
+        time, x, y, theta = self.state
+
+        return [("Time", time), ("Position", (x, y)), ("Heading", theta)]
+
+    def batch(self, samples):
+        ''' Compute the path of recorded movements in one vectorized
+            pass. samples = ((times, reports), (times, reports)) of each
+            mouse, as returned by Session_Reader.arrays(). Returns
+            (times, x, y, theta) arrays with one entry per step that
+            has movement, matching the steps of the pipeline stage '''
+
+        if(np is None):
+            raise ImportError("NumPy is required for batch odometry")
+
+        times = [np.asarray(sample[0], dtype=np.float64) for sample in samples]
+        steps, inverse = np.unique(np.concatenate([times[0] // self.period,
+                                                   times[1] // self.period]),
+                                   return_inverse=True)
+
+        # Sum the counts of each mouse per step
+        body = []
+        for index, (sample, config) in enumerate(zip(samples, self.configs)):
+            # Decoded like the live movements, by layout or by column
+            if(self.layouts[index] is not None):
+                d_x, d_y = layout_deltas(sample[1], self.layouts[index], **config)
+            else:
+                d_x, d_y = decode_deltas(sample[1], **config)
+            positions = inverse[:len(times[0])] if index == 0 else inverse[len(times[0]):]
+
+            d_x = np.bincount(positions, weights=d_x, minlength=len(steps))
+            d_y = np.bincount(positions, weights=d_y, minlength=len(steps))
+            body.extend(self.to_body(index, d_x, d_y))
+
+        t_x, t_y, d_theta = self.solve(*body)
+
+        theta = np.cumsum(d_theta)
+        heading = theta - d_theta / 2.0
+        x = np.cumsum(np.cos(heading) * t_x - np.sin(heading) * t_y)
+        y = np.cumsum(np.sin(heading) * t_x + np.cos(heading) * t_y)
+
+        return steps * self.period, x, y, theta
+
+    def reset(self):
+        ''' Return to the origin with a heading of 0 '''
+
+        with self.lock:
+            self.step = None
+            self.pending = [0, 0, 0, 0]
+            self.pose = (0.0, 0.0, 0.0)
+            self.state = (None, 0.0, 0.0, 0.0)
+
+    def close(self):
+        ''' Detach from the devices '''
+
+        for device in self.devices:
+            device.remove_stage(self)
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Decimated buffers for live plots. Speed_Trace keeps
+    the minimum and maximum of a value for each pixel column of a
+    scrolling time axis, and Path_Trace keeps the cumulative path of
+    a device thinned to a bounded number of points. Adding a sample
+    costs O(1) (amortized for paths), and drawing either one costs
+    the same however many samples were added.
+
+    Version: Python 2.7 '''
+
+from threading import Lock
+
+class Speed_Trace(object):
+    ''' Scrolling min/max envelope of a value over time. Samples may
+        be added by one thread while another draws the columns.
+
+        columns = pixel columns of the plot
+        span = seconds shown across the plot '''
+
+    def __init__(self, columns=400, span=10.0):
+        self.columns = columns
+        self.width = span / float(columns)      # Seconds per column
+        self.minimums = [None] * columns        # Ring of column minimums
+        self.maximums = [None] * columns        # Ring of column maximums
+        self.column = None                      # Newest column number
+        self.lock = Lock()                      # Columns are read while samples are added
+
+    def add(self, timestamp, value):
+        ''' Add one sample '''
+
+        column = int(timestamp // self.width)
+
+        with self.lock:
+            self.add_column(column, value)
+
+    def add_column(self, column, value):
+        ''' Add one sample to its column. The lock must be held '''
+
+        if(self.column is None or column > self.column):
+            # Clear the columns scrolled past since the last sample
+            start = column - self.columns + 1
+            if(self.column is not None):
+                start = max(start, self.column + 1)
+
+            for skipped in range(start, column + 1):
+                self.minimums[skipped % self.columns] = None
+                self.maximums[skipped % self.columns] = None
+
+            self.column = column
+
+        # Too old to be shown
+        elif(column <= self.column - self.columns):
+            return
+
+        slot = column % self.columns
+        if(self.minimums[slot] is None or value < self.minimums[slot]):
+            self.minimums[slot] = value
+        if(self.maximums[slot] is None or value > self.maximums[slot]):
+            self.maximums[slot] = value
+
+    def get_columns(self, now=None):
+        ''' Return (min, max) for each column, oldest first, or None for
+            columns without samples. now = current time in seconds, so
+            the trace scrolls while no samples arrive '''
+
+        with self.lock:
+            if(self.column is None):
+                return [None] * self.columns
+
+            end = self.column
+            if(now is not None):
+                end = max(end, int(now // self.width))
+
+            columns = []
+            for column in range(end - self.columns + 1, end + 1):
+                slot = column % self.columns
+
+                if(column > self.column or column <= self.column - self.columns or
+                   self.minimums[slot] is None):
+                    columns.append(None)
+                else:
+                    columns.append((self.minimums[slot], self.maximums[slot]))
+
+            return columns
+
+    def clear(self):
+        with self.lock:
+            self.minimums = [None] * self.columns
+            self.maximums = [None] * self.columns
+            self.column = None
+
+class Path_Trace(object):
+    ''' Cumulative path thinned to at most capacity points. A point is
+        kept once the path has moved resolution counts from the last
+        kept point; when too many are kept the resolution doubles and
+        the path is thinned again '''
+
+    def __init__(self, capacity=2000, resolution=1.0):
+        self.capacity = capacity        # Maximum points kept
+        self.resolution = resolution    # Counts between kept points
+        self.x = 0                      # Current position
+        self.y = 0
+        self.points = [(0, 0)]          # Kept points, oldest first
+
+    def add(self, d_x, d_y):
+        ''' Add one movement '''
+
+        self.x += d_x
+        self.y += d_y
+
+        last_x, last_y = self.points[-1]
+        if(abs(self.x - last_x) >= self.resolution or abs(self.y - last_y) >= self.resolution):
+            self.points.append((self.x, self.y))
+
+            if(len(self.points) > self.capacity):
+                self.thin()
+
+    def thin(self):
+        ''' Double the resolution until the path fits in three quarters
+            of the capacity '''
+
+        while(len(self.points) > self.capacity * 3 // 4):
+            self.resolution *= 2
+
+            points = [self.points[0]]
+            for x, y in self.points[1:]:
+                if(abs(x - points[-1][0]) >= self.resolution or
+                   abs(y - points[-1][1]) >= self.resolution):
+                    points.append((x, y))
+
+            self.points = points
+
+    def get_points(self):
+        ''' Return the kept points followed by the current position '''
+
+        return self.points + [(self.x, self.y)]
+
+    def clear(self):
+        self.__init__(self.capacity)
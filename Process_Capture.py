@@ -0,0 +1,240 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Shared memory ring used by the multiprocess capture
+    mode. Each device is read and decoded by its own process, which
+    writes fixed size movement records into an anonymous shared
+    mapping. The parent reads them back without pickling and
+    rebuilds Mouse_Movement objects with the decoded values filled in.
+
+    Version: Python 2.7 '''
+
+import ctypes
+import mmap
+import multiprocessing
+import os
+import select
+import struct
+import time
+from threading import Lock
+from Ring_Buffer import BLOCK, set_nonblocking
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue   # Python 3
+
+# Capture processes are forked so they inherit the device and ring
+if(hasattr(multiprocessing, 'get_context')):
+    Capture_Process = multiprocessing.get_context('fork').Process
+else:
+    Capture_Process = multiprocessing.Process
+
+# Header: write index, read index, overflows, high water mark. Each is
+# a native uint64 stored through ctypes, so the other process never sees
+# one half written (struct clears its bytes before packing them)
+HEADER = ctypes.c_uint64 * 4
+WRITE = 0
+READ = 1
+OVERFLOWS = 2
+HIGH_WATER = 3
+
+# Record: time, raw data, direction codes, speeds
+RECORD = struct.Struct('<d8sBBhhxx')
+
+# Direction names indexed by the codes stored in records
+DIRECTIONS = ("None", "Right", "Left", "Down", "Up")
+CODES = dict((name, code) for code, name in enumerate(DIRECTIONS))
+
+class Shared_Ring(object):
+    ''' Single producer, single consumer ring of movement records in
+        shared memory. The capture process writes with write() and
+        the parent reads with the consumer side of the Ring_Buffer
+        interface.
+
+        The writer cannot reclaim slots the reader may be reading, so
+        a full ring drops the newest record unless the policy is block,
+        in which case the writer waits for space. '''
+
+    def __init__(self, capacity, policy, factory):
+        self.capacity = capacity    # Maximum number of records
+        self.policy = policy        # Behaviour when full
+        self.factory = factory      # Builds a movement from (data, time, decoded)
+
+        self.memory = mmap.mmap(-1, ctypes.sizeof(HEADER) + capacity * RECORD.size)
+        self.indices = HEADER.from_buffer(self.memory)     # Shared header
+        self.wakeup = os.pipe()     # Readable while the ring holds records
+        for fd in self.wakeup:
+            set_nonblocking(fd)
+
+        self.lock = Lock()          # Serializes readers in the parent
+
+    def record_offset(self, index):
+        return ctypes.sizeof(HEADER) + (index % self.capacity) * RECORD.size
+
+    @property
+    def overflows(self):
+        return int(self.indices[OVERFLOWS])
+
+    @property
+    def high_water(self):
+        return int(self.indices[HIGH_WATER])
+
+    def write(self, movement, event=None):
+        ''' Append a movement. Returns False if it was dropped. Called
+            only by the capture process '''
+
+        indices = self.indices
+        write = indices[WRITE]
+        count = write - indices[READ]
+
+        if(count >= self.capacity):
+            if(self.policy != BLOCK):
+                indices[OVERFLOWS] += 1
+                return False
+
+            # Wait for the reader to free a slot
+            while(write - indices[READ] >= self.capacity):
+                if(event is not None and not event.is_set()):
+                    return False
+                time.sleep(0.001)
+
+            count = write - indices[READ]
+
+        decoded = movement.decode()
+        RECORD.pack_into(self.memory, self.record_offset(write), movement.time, movement.data,
+                         CODES[decoded[0]], CODES[decoded[1]],
+                         decoded[2], decoded[3])
+
+        # Publish the record
+        indices[WRITE] = write + 1
+
+        if(count + 1 > indices[HIGH_WATER]):
+            indices[HIGH_WATER] = count + 1
+
+        # Wake the reader if it had read everything before the record
+        # was published. Checked after publishing, so a reader that
+        # emptied its pipe in between still sees the record or the signal
+        if(indices[READ] >= write):
+            self.signal()
+
+        return True
+
+    def pop(self):
+        ''' Read the oldest record. The lock must be held and the ring
+            must not be empty '''
+
+        read = self.indices[READ]
+        timestamp, data, left_right, up_down, lr_spd, ud_spd = RECORD.unpack_from(
+            self.memory, self.record_offset(read))
+
+        self.indices[READ] = read + 1
+
+        # Empty the wakeup pipe, then make it readable again if a
+        # record arrived while it was being emptied
+        if(self.indices[WRITE] == read + 1):
+            self.drain()
+            if(self.indices[WRITE] != read + 1):
+                self.signal()
+
+        return self.factory(data, timestamp,
+                            (DIRECTIONS[left_right], DIRECTIONS[up_down], lr_spd, ud_spd))
+
+    def wait(self, block, timeout):
+        ''' Wait for a record. Returns False if none arrived in time.
+            The lock must be held '''
+
+        end = None if timeout is None else time.time() + timeout
+
+        while(self.empty()):
+            if(not block):
+                return False
+
+            remaining = None if end is None else end - time.time()
+            if(remaining is not None and remaining <= 0):
+                return False
+
+            if(not select.select([self.wakeup[0]], [], [], remaining)[0]):
+                return False
+
+            # Stale wakeup from a record that was already read
+            if(self.empty()):
+                self.drain()
+
+        return True
+
+    def get(self, block=True, timeout=None):
+        ''' Remove and return the oldest movement. Raises Queue.Empty if
+            no movement is available '''
+
+        with self.lock:
+            if(not self.wait(block, timeout)):
+                raise Queue.Empty
+
+            return self.pop()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_many(self, max_n=None, block=True, timeout=None):
+        ''' Wait for at least one movement, then remove and return up to
+            max_n of the oldest movements (all if None) as a list '''
+
+        with self.lock:
+            if(not self.wait(block, timeout)):
+                return []
+
+            count = self.qsize()
+            if(max_n is None or max_n > count):
+                max_n = count
+
+            return [self.pop() for index in range(max_n)]
+
+    def put(self, item, block=True, timeout=None):
+        raise NotImplementedError("Shared_Ring is written by its capture process")
+
+    def fileno(self):
+        return self.wakeup[0]
+
+    def signal(self):
+        try:
+            os.write(self.wakeup[1], b'x')
+        except OSError:
+            pass
+
+    def drain(self):
+        try:
+            while(os.read(self.wakeup[0], 512)):
+                pass
+        except OSError:
+            pass
+
+    def qsize(self):
+        return self.indices[WRITE] - self.indices[READ]
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.capacity
+
+    def clear(self):
+        ''' Drop all stored records '''
+
+        with self.lock:
+            self.indices[READ] = self.indices[WRITE]
+            self.drain()
+
+    def close(self):
+        ''' Release the shared mapping and wakeup pipe '''
+
+        if(self.wakeup is not None):
+            for fd in self.wakeup:
+                os.close(fd)
+            self.wakeup = None
+
+            # The mapping cannot close while ctypes refers to it
+            self.indices = None
+            self.memory.close()
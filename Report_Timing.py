@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Capture clock and inter-report timing statistics.
+    monotonic_ns() is a nanosecond clock unaffected by system clock
+    changes. Timing_Stats keeps the effective polling rate, interval
+    jitter and gaps of a device from the capture time of each report.
+
+    Version: Python 2.7 '''
+
+from array import array
+import ctypes
+import ctypes.util
+import time
+
+CLOCK_MONOTONIC = 1     # Linux clock ID
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def libc_monotonic_ns():
+    ''' Build a nanosecond clock from clock_gettime. Returns None if
+        it is unavailable '''
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError, TypeError):
+        return None
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    spec = timespec()
+
+    def clock():
+        clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec))
+        return spec.tv_sec * 1000000000 + spec.tv_nsec
+
+    return clock
+
+# Prefer the standard library clock (Python 3.7+), then clock_gettime,
+# then the wall clock
+if(hasattr(time, 'monotonic_ns')):
+    monotonic_ns = time.monotonic_ns
+else:
+    monotonic_ns = libc_monotonic_ns()
+    if(monotonic_ns is None):
+        def monotonic_ns():
+            return int(time.time() * 1e9)
+
+def monotonic():
+    ''' Return the capture clock in seconds '''
+
+    return monotonic_ns() / 1e9
+
+def percentile(ordered, fraction):
+    ''' Return a percentile of a sorted list '''
+
+    if(len(ordered) == 0):
+        return None
+
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Timing_Stats(object):
+    ''' Rolling timing statistics for the reports of one device.
+
+        Adding a report costs a few integer operations. Percentiles are
+        computed when the statistics are read.
+
+        size = number of recent intervals kept
+        interval = nominal polling interval in milliseconds. If None it
+                   is estimated from the median of the recent intervals
+        gap_factor = intervals longer than this many nominal intervals
+                     are gaps, where polls were missed
+        idle = intervals longer than this many seconds are the mouse
+               being still rather than gaps, and are not counted '''
+
+    def __init__(self, size=1024, interval=None, gap_factor=1.5, idle=0.05):
+        self.size = size
+        self.intervals = array('l', [0]) * size     # Recent intervals in ns
+        self.position = 0                           # Next interval slot
+        self.filled = 0                             # Slots holding intervals
+        self.gap_factor = gap_factor
+        self.idle = int(idle * 1e9)
+        self.nominal = None                         # Nominal interval in ns
+        self.estimated = True                       # Nominal interval is estimated
+        self.set_interval(interval)
+
+        self.last = None        # Capture time of the previous report
+        self.first = None       # Capture time of the first report
+        self.reports = 0        # Reports seen
+        self.gaps = 0           # Intervals with missed polls
+        self.missed = 0         # Estimated polls missed in gaps
+        self.idle_periods = 0   # Intervals where the mouse was still
+
+    def set_interval(self, interval):
+        ''' Set the nominal polling interval in milliseconds, or None
+            to estimate it '''
+
+        self.estimated = interval is None
+        if(interval is not None):
+            self.nominal = int(interval * 1e6)
+
+    def restart(self):
+        ''' Forget the previous report, so time between reads is not
+            counted as an interval '''
+
+        self.last = None
+
+    def add(self, now):
+        ''' Add the capture time of a report in nanoseconds '''
+
+        self.reports += 1
+
+        if(self.last is None):
+            self.last = now
+            if(self.first is None):
+                self.first = now
+            return
+
+        interval = now - self.last
+
+        # Reports from queued transfers may arrive out of order
+        if(interval < 0):
+            return
+
+        self.last = now
+
+        if(interval > self.idle):
+            self.idle_periods += 1
+            return
+
+        self.intervals[self.position] = interval
+        self.position += 1
+        if(self.filled < self.size):
+            self.filled += 1
+
+        nominal = self.nominal
+        if(nominal and interval > self.gap_factor * nominal):
+            self.gaps += 1
+            self.missed += int(round(float(interval) / nominal)) - 1
+
+        # Re-estimate the nominal interval once per window
+        if(self.position == self.size):
+            self.position = 0
+            if(self.estimated):
+                self.nominal = sorted(self.intervals)[self.size // 2]
+
+    def get_stats(self):
+        ''' Return the statistics as a list of tuples. Times are in
+            microseconds '''
+
+        intervals = sorted(self.intervals[:self.filled])
+        nominal = self.nominal or percentile(intervals, 0.5)
+
+        rate = None
+        if(len(intervals) > 0):
+            rate = 1e9 * len(intervals) / sum(intervals)
+
+        jitter = []
+        if(nominal):
+            jitter = sorted(abs(interval - nominal) for interval in intervals)
+
+        def micro(value):
+            return None if value is None else value / 1000.0
+
+        return [("Reports", self.reports),
+                ("Rate_Hz", rate),
+                ("Nominal_Interval_us", micro(nominal)),
+                ("Interval_p50_us", micro(percentile(intervals, 0.5))),
+                ("Interval_p99_us", micro(percentile(intervals, 0.99))),
+                ("Jitter_p50_us", micro(percentile(jitter, 0.5))),
+                ("Jitter_p90_us", micro(percentile(jitter, 0.9))),
+                ("Jitter_p99_us", micro(percentile(jitter, 0.99))),
+                ("Gaps", self.gaps),
+                ("Missed_Polls", self.missed),
+                ("Idle_Periods", self.idle_periods)]
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Fixed capacity ring buffer used to hold recorded
+    movements. Storage is allocated once, and a full buffer either
+    drops the oldest item, drops the newest item or blocks the
+    writer depending on its policy.
+
+    Version: Python 2.7 '''
+
+from threading import Condition, Lock
+import errno
+import fcntl
+import os
+import time
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue   # Python 3
+
+# Overflow policies
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+
+class Ring_Buffer(object):
+    ''' Thread safe FIFO with a fixed capacity. Supports the parts of
+        the Queue.Queue interface used by USB_Mouse. '''
+
+    def __init__(self, capacity=65536, policy=DROP_OLDEST):
+        if(policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK)):
+            raise ValueError("Unknown overflow policy: " + str(policy))
+
+        if(capacity < 1):
+            raise ValueError("Capacity must be at least 1")
+
+        self.capacity = capacity            # Maximum number of items
+        self.policy = policy                # Behaviour when full
+        self.items = [None] * capacity      # Preallocated storage
+        self.head = 0                       # Index of the oldest item
+        self.count = 0                      # Number of stored items
+
+        self.overflows = 0                  # Items dropped because the buffer was full
+        self.high_water = 0                 # Largest number of items stored at once
+
+        lock = Lock()
+        self.not_empty = Condition(lock)    # Signaled when an item is added
+        self.not_full = Condition(lock)     # Signaled when an item is removed
+
+        self.wakeup = None                  # (read, write) pipe for select, made on demand
+        self.interrupted = False            # Blocked writers give up until resumed
+
+    def put(self, item, block=True, timeout=None):
+        ''' Add an item. Never raises. Returns True if the item was
+            stored and False if it was dropped. Only the block policy
+            waits for space, and only if block is set. '''
+
+        with self.not_full:
+            if(self.count == self.capacity):
+                if(self.policy == BLOCK and block):
+                    if(not self.wait(self.not_full, self.blocked, timeout) or self.full()):
+                        self.overflows += 1
+                        return False
+
+                elif(self.policy == DROP_OLDEST):
+                    # Overwrite the oldest item in place
+                    self.items[self.head] = item
+                    self.head = (self.head + 1) % self.capacity
+                    self.overflows += 1
+                    self.not_empty.notify()
+                    return True
+
+                else:
+                    self.overflows += 1
+                    return False
+
+            self.items[(self.head + self.count) % self.capacity] = item
+            self.count += 1
+
+            if(self.count > self.high_water):
+                self.high_water = self.count
+
+            # Wake select() callers when the buffer stops being empty
+            if(self.count == 1 and self.wakeup is not None):
+                self.signal()
+
+            self.not_empty.notify()
+            return True
+
+    def get(self, block=True, timeout=None):
+        ''' Remove and return the oldest item. Raises Queue.Empty if
+            no item is available '''
+
+        with self.not_empty:
+            if(self.count == 0):
+                if(not block or not self.wait(self.not_empty, self.empty, timeout)):
+                    raise Queue.Empty
+
+            item = self.pop()
+
+            self.not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_many(self, max_n=None, block=True, timeout=None):
+        ''' Wait for at least one item, then remove and return up to
+            max_n of the oldest items (all if None) as a list. Returns
+            an empty list if nothing arrived in time '''
+
+        with self.not_empty:
+            if(self.count == 0):
+                if(not block or not self.wait(self.not_empty, self.empty, timeout)):
+                    return []
+
+            if(max_n is None or max_n > self.count):
+                max_n = self.count
+
+            items = [self.pop() for index in range(max_n)]
+
+            self.not_full.notify_all()
+            return items
+
+    def pop(self):
+        ''' Remove the oldest item. The lock must be held and the
+            buffer must not be empty. '''
+
+        item = self.items[self.head]
+        self.items[self.head] = None
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+
+        if(self.count == 0 and self.wakeup is not None):
+            self.drain()
+
+        return item
+
+    def fileno(self):
+        ''' Return a file descriptor that is readable while the buffer
+            holds items, so the buffer can be passed to select() '''
+
+        with self.not_empty:
+            if(self.wakeup is None):
+                self.wakeup = os.pipe()
+                for fd in self.wakeup:
+                    set_nonblocking(fd)
+
+                if(self.count > 0):
+                    self.signal()
+
+            return self.wakeup[0]
+
+    def signal(self):
+        ''' Make the wakeup pipe readable '''
+
+        try:
+            os.write(self.wakeup[1], b'x')
+        except OSError as error:
+            if(error.errno != errno.EAGAIN):
+                raise
+
+    def drain(self):
+        ''' Empty the wakeup pipe '''
+
+        try:
+            while(os.read(self.wakeup[0], 512)):
+                pass
+        except OSError as error:
+            if(error.errno != errno.EAGAIN):
+                raise
+
+    def interrupt(self):
+        ''' Wake writers blocked on a full buffer. They drop their item,
+            as does any later blocking put until resume() is called '''
+
+        with self.not_full:
+            self.interrupted = True
+            self.not_full.notify_all()
+
+    def resume(self):
+        ''' Let blocking puts wait for space again '''
+
+        with self.not_full:
+            self.interrupted = False
+
+    def close(self):
+        ''' Close the wakeup pipe if one was made and wake blocked
+            writers '''
+
+        with self.not_empty:
+            self.interrupted = True
+            self.not_full.notify_all()
+
+            if(self.wakeup is not None):
+                for fd in self.wakeup:
+                    os.close(fd)
+                self.wakeup = None
+
+    def wait(self, condition, predicate, timeout):
+        ''' Wait on a condition while predicate holds. Returns False
+            on timeout. The lock must be held. '''
+
+        if(timeout is None):
+            while(predicate()):
+                condition.wait()
+            return True
+
+        # Wait for whatever remains of the timeout on each wakeup
+        end = time.time() + timeout
+        while(predicate()):
+            remaining = end - time.time()
+            if(remaining <= 0):
+                return False
+            condition.wait(remaining)
+
+        return True
+
+    def qsize(self):
+        return self.count
+
+    def empty(self):
+        return self.count == 0
+
+    def full(self):
+        return self.count == self.capacity
+
+    def blocked(self):
+        ''' Return True while a blocking put must keep waiting '''
+
+        return self.count == self.capacity and not self.interrupted
+
+    def clear(self):
+        ''' Drop all stored items without counting them as overflows '''
+
+        with self.not_full:
+            for index in range(self.capacity):
+                self.items[index] = None
+            self.head = 0
+            self.count = 0
+
+            if(self.wakeup is not None):
+                self.drain()
+
+            self.not_full.notify_all()
+
+def set_nonblocking(fd):
+    ''' Put a file descriptor in non-blocking mode '''
+
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -0,0 +1,407 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Append-only binary recording of mouse sessions and a
+    memory-mapped reader to replay them.
+
+    File layout (little endian):
+        header   magic, version, device count, header size
+        devices  one entry per device: number, vendor ID, product ID,
+                 the six Mouse_Movement parameters and the HID report
+                 layout (HID_Descriptor.LAYOUT)
+        records  fixed size: time (float64), raw report, device index
+                 (uint16), padding to a multiple of 8 bytes. Reports
+                 are 8 bytes, or the longest layout's report length
+
+    Version 1 files have no layouts and 8 byte reports, and can still
+    be read.
+
+    Chunked files share the header but group records into chunks of
+    one device each. Every chunk starts with its device index, record
+    count and first and last times, and the file ends with an index of
+    all chunks so a time range is found with a binary search:
+        chunks   chunk header followed by its records
+        index    one entry per chunk: device, count, first and last
+                 times, file offset
+        trailer  offset of the index, magic
+
+    Version: Python 2.7 '''
+
+from threading import Lock
+import bisect
+import mmap
+import struct
+from HID_Descriptor import LAYOUT, pack_layout, unpack_layout
+from USB_Transport import Replay_Transport
+
+# NumPy is only needed for the array view of a session
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'MOUSESES'
+VERSION = 2
+
+HEADER = struct.Struct('<8sHHI')
+DEVICE = struct.Struct('<iii6i')
+
+CHUNKED_MAGIC = b'MOUSECHK'
+CHUNK = struct.Struct('<H2xIdd')
+INDEX_ENTRY = struct.Struct('<H2xIddQ')
+TRAILER = struct.Struct('<Q8s')
+
+# Mouse_Movement parameters in file order, with their defaults
+CONFIG_KEYS = ('lr_col', 'ud_col', 'lr_max', 'ud_max', 'rev_lr', 'rev_ud')
+CONFIG_DEFAULTS = (1, 2, 255, 255, 0, 0)
+
+def report_size(layouts):
+    ''' Return the report length stored for devices with these
+        layouts '''
+
+    return max([8] + [layout.size for layout in layouts if layout is not None])
+
+def record_struct(size):
+    ''' Return the record of reports of size bytes '''
+
+    return struct.Struct('<d%dsH%dx' % (size, -(10 + size) % 8))
+
+def record_dtype(size):
+    ''' Return the NumPy dtype of record_struct(size) '''
+
+    return np.dtype([('time', '<f8'), ('raw', 'u1', (size,)),
+                     ('device', '<u2'), ('pad', 'V%d' % (-(10 + size) % 8))])
+
+def pack_device(device):
+    ''' Return the devices entry of a USB_Mouse '''
+
+    config = [device.movement_config.get(key, default)
+              for key, default in zip(CONFIG_KEYS, CONFIG_DEFAULTS)]
+
+    return (DEVICE.pack(device.num, device.vendor, device.prod_id, *config) +
+            pack_layout(device.layout))
+
+def unpack_device(data, offset, layout=True):
+    ''' Return a devices entry as a dictionary. Version 1 entries have
+        no layout '''
+
+    fields = DEVICE.unpack_from(data, offset)
+
+    return {"num": fields[0], "vendor": fields[1], "prod_id": fields[2],
+            "config": dict(zip(CONFIG_KEYS, fields[3:])),
+            "layout": unpack_layout(data, offset + DEVICE.size) if layout else None}
+
+def read_devices(memory, path, magic, kind="session"):
+    ''' Check the header of a session file and return its header
+        size and devices '''
+
+    file_magic, version, count, header_size = HEADER.unpack_from(memory, 0)
+
+    if(file_magic != magic or version not in (1, VERSION)):
+        raise ValueError("Not a %s file: %s" % (kind, path))
+
+    size = DEVICE.size + (LAYOUT.size if version > 1 else 0)
+    devices = [unpack_device(memory, HEADER.size + index * size, version > 1)
+               for index in range(count)]
+
+    return header_size, devices
+
+class Session_Recorder(object):
+    ''' Pipeline stage that appends every movement of a set of
+        devices to a session file '''
+
+    magic = MAGIC   # File type written in the header
+
+    def __init__(self, path, devices):
+        self.path = path                # Session file
+        self.devices = list(devices)    # Devices recorded
+        self.indices = dict((id(device), index) for index, device in enumerate(self.devices))
+        self.count = 0                  # Records written
+        self.lock = Lock()              # Devices are read by separate threads
+
+        # Records hold the longest report a layout describes
+        self.record = record_struct(report_size([device.layout for device in self.devices]))
+
+        self.file = open(path, 'wb')
+
+        entries = [pack_device(device) for device in self.devices]
+        header_size = HEADER.size + sum(len(entry) for entry in entries)
+        self.file.write(HEADER.pack(self.magic, VERSION, len(self.devices), header_size))
+
+        for entry in entries:
+            self.file.write(entry)
+
+    def write(self, device, movement):
+        ''' Append one movement '''
+
+        record = self.record.pack(movement.time, movement.data, self.indices[id(device)])
+
+        with self.lock:
+            self.file.write(record)
+            self.count += 1
+
+    def close(self):
+        ''' Detach from the devices and close the file '''
+
+        for device in self.devices:
+            device.remove_stage(self)
+
+        with self.lock:
+            if(not self.file.closed):
+                self.file.close()
+
+class Chunked_Recorder(Session_Recorder):
+    ''' Pipeline stage that appends movements to a chunked session
+        file. Records are buffered per device and written a chunk at
+        a time; the chunk index is written when the recorder closes '''
+
+    magic = CHUNKED_MAGIC
+
+    def __init__(self, path, devices, chunk_size=4096):
+        super(Chunked_Recorder, self).__init__(path, devices)
+
+        self.chunk_size = chunk_size                            # Records per chunk
+        self.buffers = [bytearray() for device in self.devices] # Pending records
+        self.first = [0.0] * len(self.devices)                  # Time of each pending chunk
+        self.index = []                                         # Written chunks
+
+    def write(self, device, movement):
+        ''' Buffer one movement, writing its chunk once full '''
+
+        index = self.indices[id(device)]
+        buff = self.buffers[index]
+
+        with self.lock:
+            if(len(buff) == 0):
+                self.first[index] = movement.time
+
+            buff += self.record.pack(movement.time, movement.data, index)
+            self.count += 1
+
+            if(len(buff) >= self.chunk_size * self.record.size):
+                self.write_chunk(index, movement.time)
+
+    def write_chunk(self, index, last):
+        ''' Write the pending records of a device as a chunk. The lock
+            must be held '''
+
+        buff = self.buffers[index]
+        count = len(buff) // self.record.size
+
+        self.index.append((index, count, self.first[index], last, self.file.tell()))
+        self.file.write(CHUNK.pack(index, count, self.first[index], last))
+        self.file.write(buff)
+
+        del buff[:]
+
+    def close(self):
+        ''' Flush partial chunks, write the index and close the file '''
+
+        for device in self.devices:
+            device.remove_stage(self)
+
+        with self.lock:
+            if(self.file.closed):
+                return
+
+            for index, buff in enumerate(self.buffers):
+                if(len(buff) > 0):
+                    last = self.record.unpack_from(buff, len(buff) - self.record.size)[0]
+                    self.write_chunk(index, last)
+
+            offset = self.file.tell()
+            for entry in self.index:
+                self.file.write(INDEX_ENTRY.pack(*entry))
+            self.file.write(TRAILER.pack(offset, CHUNKED_MAGIC))
+
+            self.file.close()
+
+class Session_Records(object):
+    ''' Sequence of (seconds, report) pairs for one device, read
+        directly from the mapped file '''
+
+    def __init__(self, session, offsets):
+        self.session = session      # Session_Reader
+        self.offsets = offsets      # File offset of each record
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, position):
+        timestamp, data, index = self.session.record.unpack_from(self.session.memory, self.offsets[position])
+        return (timestamp, list(bytearray(data)))
+
+class Session_Reader(object):
+    ''' Memory-mapped reader for a session file '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # One dictionary per recorded device
+        self.header_size, self.devices = read_devices(self.memory, path, MAGIC)
+
+        self.size = report_size([device["layout"] for device in self.devices])     # Report length
+        self.record = record_struct(self.size)
+
+        # A partially written trailing record is ignored
+        self.count = (len(self.memory) - self.header_size) // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def records(self):
+        ''' Return every record as a NumPy structured array with time,
+            raw and device fields. The array is a view of the file '''
+
+        if(np is None):
+            raise ImportError("NumPy is required for array access")
+
+        return np.frombuffer(self.memory, dtype=record_dtype(self.size),
+                             count=self.count, offset=self.header_size)
+
+    def arrays(self, index):
+        ''' Return (times, reports) arrays for one device '''
+
+        records = self.records()
+        selected = records[records['device'] == index]
+
+        return selected['time'], selected['raw']
+
+    def device_records(self, index):
+        ''' Return a Session_Records sequence for one device '''
+
+        if(np is not None):
+            positions = np.nonzero(self.records()['device'] == index)[0]
+        else:
+            positions = [position for position in range(self.count)
+                         if self.record.unpack_from(self.memory, self.offset(position))[2] == index]
+
+        return Session_Records(self, [self.offset(position) for position in positions])
+
+    def offset(self, position):
+        return self.header_size + position * self.record.size
+
+    def transport(self, index, speed=1.0):
+        ''' Return a Replay_Transport that plays back one device with
+            its original timing '''
+
+        device = self.devices[index]
+        return Replay_Transport(self.device_records(index), speed=speed,
+                                ids=(device["vendor"], device["prod_id"]), layout=device["layout"])
+
+    def close(self):
+        self.memory.close()
+        self.file.close()
+
+class Chunked_Session(object):
+    ''' Memory-mapped reader for a chunked session file. Time range
+        queries binary search a per-device index and only touch the
+        chunks that overlap the range '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.header_size, self.devices = read_devices(self.memory, path, CHUNKED_MAGIC, "chunked session")
+
+        self.size = report_size([device["layout"] for device in self.devices])     # Report length
+        self.record = record_struct(self.size)
+
+        # Per device lists of chunk (first time, last time, offset, count)
+        self.firsts = [[] for device in self.devices]
+        self.lasts = [[] for device in self.devices]
+        self.chunks = [[] for device in self.devices]
+
+        for index, chunk_count, first, last, offset in self.read_index():
+            self.firsts[index].append(first)
+            self.lasts[index].append(last)
+            self.chunks[index].append((offset + CHUNK.size, chunk_count))
+
+    def read_index(self):
+        ''' Return the chunk index from the end of the file, or rebuild
+            it by walking the chunks if the recorder did not close '''
+
+        size = len(self.memory)
+
+        if(size >= self.header_size + TRAILER.size):
+            offset, magic = TRAILER.unpack_from(self.memory, size - TRAILER.size)
+
+            if(magic == CHUNKED_MAGIC):
+                entries = (size - TRAILER.size - offset) // INDEX_ENTRY.size
+                return [INDEX_ENTRY.unpack_from(self.memory, offset + entry * INDEX_ENTRY.size)
+                        for entry in range(entries)]
+
+        entries = []
+        offset = self.header_size
+
+        while(offset + CHUNK.size <= size):
+            index, count, first, last = CHUNK.unpack_from(self.memory, offset)
+            if(offset + CHUNK.size + count * self.record.size > size):
+                break
+
+            entries.append((index, count, first, last, offset))
+            offset += CHUNK.size + count * self.record.size
+
+        return entries
+
+    def __len__(self):
+        return sum(count for chunks in self.chunks for offset, count in chunks)
+
+    def overlapping(self, index, t0, t1):
+        ''' Return (offset, count) of the chunks of a device that may
+            hold records in [t0, t1) '''
+
+        start = bisect.bisect_left(self.lasts[index], t0)
+        end = bisect.bisect_left(self.firsts[index], t1)
+
+        return self.chunks[index][start:end]
+
+    def slice(self, index, t0, t1):
+        ''' Return the (seconds, report) pairs of one device captured
+            in [t0, t1). The result can be replayed by Replay_Transport '''
+
+        records = []
+
+        for offset, count in self.overlapping(index, t0, t1):
+            for position in range(count):
+                timestamp, data, device = self.record.unpack_from(self.memory, offset + position * self.record.size)
+                if(t0 <= timestamp < t1):
+                    records.append((timestamp, list(bytearray(data))))
+
+        return records
+
+    def slice_arrays(self, index, t0, t1):
+        ''' Return (times, reports) NumPy arrays of one device captured
+            in [t0, t1) '''
+
+        if(np is None):
+            raise ImportError("NumPy is required for array access")
+
+        dtype = record_dtype(self.size)
+        parts = [np.frombuffer(self.memory, dtype=dtype, count=count, offset=offset)
+                 for offset, count in self.overlapping(index, t0, t1)]
+
+        if(len(parts) == 0):
+            return np.zeros(0), np.zeros((0, self.size), dtype=np.uint8)
+
+        records = np.concatenate(parts)
+        records = records[(records['time'] >= t0) & (records['time'] < t1)]
+
+        return records['time'], records['raw']
+
+    def transport(self, index, t0=float('-inf'), t1=float('inf'), speed=1.0):
+        ''' Return a Replay_Transport that plays back one device between
+            two times '''
+
+        device = self.devices[index]
+        return Replay_Transport(self.slice(index, t0, t1), speed=speed,
+                                ids=(device["vendor"], device["prod_id"]), layout=device["layout"])
+
+    def close(self):
+        self.memory.close()
+        self.file.close()
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Named shared memory stream of one device's movements
+    for other processes on the same host. Shared_Stream_Writer is a
+    pipeline stage that writes fixed size records into a ring in a
+    file in /dev/shm and then advances a sequence counter. It never
+    waits for readers: the oldest records are overwritten. Any number
+    of Shared_Stream_Reader objects, in any process, map the file and
+    read records straight from the mapping with their own cursors.
+
+    File layout (little endian):
+        header   magic, version, capacity, open flag
+        device   number, vendor ID, product ID, the six
+                 Mouse_Movement parameters and the HID report layout,
+                 as in session files
+        counter  sequence number of the next record (uint64, native
+                 byte order so it is written and read in one access)
+        records  fixed size: sequence number (uint64), time
+                 (float64), raw report (8 bytes, or the layout's
+                 report length), padding to a multiple of 8 bytes
+
+    A reader whose record was overwritten while it was being read, or
+    which fell more than capacity records behind, skips ahead and
+    counts the records it lost.
+
+    A writer builds its file under a temporary name and renames it
+    into place, so a restarted writer never truncates a file that
+    readers have mapped. Idle readers notice the new file and attach
+    to it.
+
+    Version: Python 2.7 '''
+
+import ctypes
+import mmap
+import os
+import struct
+import tempfile
+import time
+from HID_Descriptor import LAYOUT
+from Session_Recorder import DEVICE, pack_device, unpack_device, report_size
+
+MAGIC = b'MOUSESHM'
+VERSION = 2
+
+HEADER = struct.Struct('<8sIII')
+STATE = struct.Struct('<I')
+COUNTER = struct.Struct('Q')
+
+# Offsets in the file
+STATE_OFFSET = HEADER.size - STATE.size
+DEVICE_OFFSET = HEADER.size
+COUNTER_OFFSET = (DEVICE_OFFSET + DEVICE.size + LAYOUT.size + 7) // 8 * 8
+RECORDS_OFFSET = COUNTER_OFFSET + COUNTER.size
+
+# Streams live in memory backed files when the system has them
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+def stream_path(name):
+    ''' Return the file of a named stream '''
+
+    return os.path.join(SHM_DIR, name)
+
+def record_struct(layout):
+    ''' Return the record of a device with this layout, or None '''
+
+    size = report_size([layout])
+    return struct.Struct('<Qd%ds%dx' % (size, -size % 8))
+
+class Shared_Stream_Writer(object):
+    ''' Pipeline stage that publishes the movements of one device to a
+        named shared memory ring. Writing a movement is two stores into
+        the mapping, with no locks or system calls.
+
+        name = stream name, the file name in /dev/shm
+        capacity = records kept for readers that fall behind '''
+
+    def __init__(self, name, device, capacity=65536):
+        self.name = name
+        self.path = stream_path(name)
+        self.device = device
+        self.capacity = capacity
+        self.sequence = 0           # Sequence number of the next record
+        self.record = record_struct(device.layout)     # Record of this device
+
+        size = RECORDS_OFFSET + capacity * self.record.size
+
+        # The stream is built under another name. Readers of a stream
+        # left by an earlier writer keep their mapping of its file
+        temp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(temp, 'w+b') as stream_file:
+            stream_file.truncate(size)
+            self.memory = mmap.mmap(stream_file.fileno(), size)
+            self.inode = os.fstat(stream_file.fileno()).st_ino
+
+        entry = pack_device(device)
+        self.memory[DEVICE_OFFSET:DEVICE_OFFSET + len(entry)] = entry
+
+        # struct clears its bytes before packing them, so a reader could
+        # see a counter of 0. It is stored through ctypes in one write
+        self.counter = ctypes.c_uint64.from_buffer(self.memory, COUNTER_OFFSET)
+        self.counter.value = 0
+
+        HEADER.pack_into(self.memory, 0, MAGIC, VERSION, capacity, 1)
+        os.rename(temp, self.path)
+
+    def write(self, device, movement):
+        ''' Write one movement, overwriting the oldest record '''
+
+        sequence = self.sequence
+        self.record.pack_into(self.memory, RECORDS_OFFSET + (sequence % self.capacity) * self.record.size,
+                              sequence, movement.time, movement.data)
+
+        # Publish the record
+        self.sequence = sequence + 1
+        self.counter.value = self.sequence
+
+    def close(self, unlink=True):
+        ''' Detach from the device and mark the stream closed. Readers
+            that have the stream open keep reading what remains. If
+            unlink is set the file is removed '''
+
+        self.device.remove_stage(self)
+
+        if(self.memory is None):
+            return
+
+        STATE.pack_into(self.memory, STATE_OFFSET, 0)
+
+        # The mapping cannot close while ctypes refers to it
+        self.counter = None
+        self.memory.close()
+        self.memory = None
+
+        # A newer writer may have replaced the file
+        if(unlink):
+            try:
+                if(os.stat(self.path).st_ino == self.inode):
+                    os.unlink(self.path)
+            except OSError:
+                pass
+
+class Shared_Stream_Reader(object):
+    ''' Reads a named stream with its own cursor.
+
+        name = stream name
+        start = "latest" to read movements written from now on,
+                "oldest" to begin with the oldest record still kept
+        poll = seconds between checks while waiting for movements
+        movement = class used to rebuild movements, Mouse_Movement by
+                   default. Devices with a HID report layout give
+                   HID_Movement objects '''
+
+    def __init__(self, name, start="latest", poll=0.001, movement=None):
+        if(start not in ("latest", "oldest")):
+            raise ValueError("Unknown start: " + str(start))
+
+        # Imported here, USB_Device imports this module
+        from USB_Device import HID_Movement
+        if(movement is None):
+            from USB_Device import Mouse_Movement as movement
+
+        self.name = name
+        self.path = stream_path(name)
+        self.poll = poll
+        self.movement = movement
+        self.hid_movement = HID_Movement
+        self.lost = 0               # Records overwritten before they were read
+        self.memory = None
+
+        self.attach(start)
+
+    def attach(self, start):
+        ''' Map the current file of the stream '''
+
+        with open(self.path, 'rb') as stream_file:
+            memory = mmap.mmap(stream_file.fileno(), 0, access=mmap.ACCESS_READ)
+            inode = os.fstat(stream_file.fileno()).st_ino
+
+        magic, version, capacity, state = HEADER.unpack_from(memory, 0)
+        if(magic != MAGIC or version != VERSION):
+            memory.close()
+            raise ValueError("Not a movement stream: " + str(self.name))
+
+        if(self.memory is not None):
+            self.memory.close()
+
+        self.memory = memory
+        self.inode = inode          # File mapped, a new file means a new writer
+        self.capacity = capacity
+
+        device = unpack_device(self.memory, DEVICE_OFFSET)
+        self.num = device["num"]                # Device number
+        self.vendor = device["vendor"]
+        self.prod_id = device["prod_id"]
+        self.config = device["config"]          # Mouse_Movement parameters
+        self.layout = device["layout"]          # Report_Layout, None if column decoded
+        self.record = record_struct(self.layout)
+
+        self.cursor = self.counter()    # Sequence number of the next record to read
+        if(start == "oldest"):
+            self.cursor = max(0, self.cursor - self.capacity + 1)
+
+    def replaced(self):
+        ''' Return True if a new writer has replaced the stream '''
+
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return False
+
+    def counter(self):
+        return COUNTER.unpack_from(self.memory, COUNTER_OFFSET)[0]
+
+    def is_open(self):
+        ''' Return True while the writer is publishing '''
+
+        return STATE.unpack_from(self.memory, STATE_OFFSET)[0] == 1
+
+    def available(self):
+        ''' Return the number of records waiting for this reader '''
+
+        return self.counter() - self.cursor
+
+    def read(self, max_n=None):
+        ''' Return up to max_n waiting movements (all if None) without
+            waiting '''
+
+        written = self.counter()
+        record = self.record
+
+        # Records the writer has lapped are gone. The slot after the
+        # newest record may be being overwritten, so it is skipped too
+        oldest = written - self.capacity + 1
+        if(self.cursor < oldest):
+            self.lost += oldest - self.cursor
+            self.cursor = oldest
+
+        end = written
+        if(max_n is not None):
+            end = min(end, self.cursor + max_n)
+
+        records = []
+        for sequence in range(self.cursor, end):
+            records.append(record.unpack_from(self.memory, RECORDS_OFFSET +
+                                              (sequence % self.capacity) * record.size))
+
+        # Drop records the writer reached while they were being read
+        written = self.counter()
+        oldest = written - self.capacity + 1
+        valid = [record for sequence, record in zip(range(self.cursor, end), records)
+                 if sequence >= oldest and record[0] == sequence]
+
+        self.lost += len(records) - len(valid)
+        if(oldest > end):
+            self.lost += oldest - end
+
+        self.cursor = max(self.cursor, end, oldest)
+
+        if(self.layout is not None):
+            return [self.hid_movement(self.num, data, self.layout, timestamp=timestamp, **self.config)
+                    for sequence, timestamp, data in valid]
+
+        return [self.movement(self.num, data, timestamp=timestamp, **self.config)
+                for sequence, timestamp, data in valid]
+
+    def get_movements(self, max_n=None, timeout=0):
+        ''' Wait up to timeout seconds (forever if None) for a movement,
+            then return up to max_n waiting movements. A writer that
+            restarted is followed from its first movement '''
+
+        end = None if timeout is None else time.time() + timeout
+
+        while(True):
+            movements = self.read(max_n)
+            if(len(movements) > 0 or (end is not None and time.time() >= end)):
+                return movements
+
+            # Only checked while idle, the stream is read without system calls
+            if(self.replaced()):
+                try:
+                    self.attach("oldest")
+                    continue
+                except (IOError, OSError, ValueError):
+                    pass
+
+            if(not self.is_open() and self.available() <= 0):
+                return movements
+
+            time.sleep(self.poll)
+
+    def get_movement(self, timeout=0):
+        ''' Return the next movement, or None if none arrived in time '''
+
+        movements = self.get_movements(1, timeout)
+        return movements[0] if movements else None
+
+    def __iter__(self):
+        ''' Yield movements until the writer closes the stream '''
+
+        while(True):
+            movements = self.get_movements(None, 0.5)
+
+            for movement in movements:
+                yield movement
+
+            if(len(movements) == 0 and not self.is_open()):
+                return
+
+    def close(self):
+        self.memory.close()
@@ -15,9 +15,46 @@
 
 from collections import Counter
 from threading import Thread, Event
-import usb.core
-import usb.util
-import Queue
+import multiprocessing
+import sys
+import time
+from USB_Transport import PyUSB_Transport, Transport_Error
+from Ring_Buffer import Ring_Buffer, DROP_OLDEST
+from Process_Capture import Shared_Ring, Capture_Process
+from Session_Recorder import Session_Recorder, Session_Reader, Chunked_Recorder, Chunked_Session
+from Motion_Accumulator import Motion_Accumulator
+from Merge_Stream import Merged_Stream
+from Odometry import Odometry
+from Device_Index import Device_Index, is_mouse
+from Device_Profiles import Profile_Registry, Calibrator, PHASES
+from HID_Descriptor import parse_layout
+from Report_Timing import Timing_Stats, monotonic, monotonic_ns
+from Device_Stats import Device_Stats, Stats_Server
+from Latency_Trace import Latency_Tracer
+from Net_Stream import Movement_Publisher, Movement_Subscriber
+from Shared_Stream import Shared_Stream_Writer, Shared_Stream_Reader
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue   # Python 3
+
+try:
+    input = raw_input
+except NameError:
+    pass                    # Python 3
+
+# NumPy is only needed for batch decoding
+try:
+    from Movement_Batch import Movement_Batch
+except ImportError:
+    Movement_Batch = None
+
+# asyncio streaming is only available on Python 3
+if(sys.version_info >= (3, 5)):
+    from Async_Stream import Movement_Stream, next_movement
+else:
+    Movement_Stream = None
 
 class Mouse_Movement(object):
     ''' Analyze the movement of USB Mouse, the default is below
@@ -37,90 +74,221 @@ class Mouse_Movement(object):
         5. If downward movement values are larger than upward movement values
                 rev_ud = 1 '''
 
+    # Movements store raw data as bytes and only decode it when asked.
+    # The configuration is interned so every movement shares one tuple
+    __slots__ = ('device', 'data', 'time', 'config', 'decoded', 'trace')
+    configs = {}
+
+    # Each configuration is compiled once into per-axis lookup tables
+    # of (direction, speed, delta) indexed by the raw byte
+    tables = {}
+
     def __init__(self, device, data_list, lr_col=1, ud_col=2,
-                 lr_max=255, ud_max=255, rev_lr=0, rev_ud=0):
+                 lr_max=255, ud_max=255, rev_lr=0, rev_ud=0, timestamp=None):
+
+        # (lr_col, ud_col, lr_max, ud_max, rev_lr, rev_ud) with the
+        # maximum values stored as a range
+        config = (lr_col, ud_col, lr_max + 1, ud_max + 1, rev_lr, rev_ud)
+        self.config = Mouse_Movement.configs.setdefault(config, config)
+
+        # Raw data, kept as is when the transport read bytes
+        if(isinstance(data_list, bytes)):
+            self.data = data_list
+        else:
+            self.data = bytes(bytearray(data_list))
+        self.device = device                        # Device
+        self.decoded = None                         # Cached (dir, dir, spd, spd)
+
+        # Time the data was read
+        if(timestamp is None):
+            timestamp = monotonic()
+        self.time = timestamp
+
+    @property
+    def raw(self):
+        return list(bytearray(self.data))
+
+    @property
+    def left_right(self):
+        return self.decode()[0]
+
+    @property
+    def up_down(self):
+        return self.decode()[1]
+
+    @property
+    def left_right_spd(self):
+        return self.decode()[2]
+
+    @property
+    def up_down_spd(self):
+        return self.decode()[3]
+
+    def decode(self):
+        ''' Analyze the raw data on first use and cache the result '''
+
+        if(self.decoded is None):
+            lr_table, ud_table = self.get_tables()
+            raw = bytearray(self.data)
+            left_right = lr_table[raw[self.config[0]]]
+            up_down = ud_table[raw[self.config[1]]]
+            self.decoded = (left_right[0], up_down[0], left_right[1], up_down[1])
+
+        return self.decoded
+
+    def get_tables(self):
+        ''' Return the lookup tables of the movement's configuration,
+            compiling them on first use '''
+
+        tables = Mouse_Movement.tables.get(self.config)
+        if(tables is None):
+            tables = Mouse_Movement.compile_tables(self.config)
+            Mouse_Movement.tables[self.config] = tables
 
-        self.lr_col = lr_col        # Left/Right col in data array
-        self.ud_col = ud_col        # Up/Down col in data array
-        self.lr_max = lr_max + 1    # Left/Right maximum value
-        self.ud_max = ud_max + 1    # Up/Down maximum value
-        self.rev_lr = rev_lr        # Reverse Left/Right (Right max)
-        self.rev_ud = rev_ud        # Reverse Up/Down (Down max)
+        return tables
 
-        self.raw = data_list        # Raw data
+    @staticmethod
+    def compile_tables(config):
+        ''' Build the 256 entry tables of a configuration by running
+            the reference decoder on every byte value '''
 
-        self.left_right = "None"    # Movement direction
-        self.up_down = "None"
-        self.left_right_spd = 0     # Movement speed
-        self.up_down_spd = 0
-        self.left_right_acc = 0     # Movement acceleration
-        self.up_down_acc = 0
-        self.device = device        # Device
+        lr_col, ud_col = config[0], config[1]
 
-        self.analyze_dir()          # Analyze raw data
-        self.analyze_spd()
+        movement = Mouse_Movement.__new__(Mouse_Movement)
+        movement.config = config
+
+        lr_table = []
+        ud_table = []
+
+        for value in range(256):
+            raw = bytearray(max(lr_col, ud_col) + 1)
+            raw[lr_col] = value
+            raw[ud_col] = value
+            movement.data = bytes(raw)
+
+            direc = movement.analyze_dir()
+            speed = movement.analyze_spd()
+            delta = movement.analyze_delta()
+
+            lr_table.append((direc[0], speed[0], delta[0]))
+            ud_table.append((direc[1], speed[1], delta[1]))
+
+        return (tuple(lr_table), tuple(ud_table))
 
     def analyze_dir(self):
         ''' Use the raw data collected from the mouse to
             determine its direction '''
 
+        lr_col, ud_col, lr_max, ud_max, rev_lr, rev_ud = self.config
+        raw = bytearray(self.data)
+
+        left_right = "None"
+        up_down = "None"
+
         # Calculate the median of possible l/r and u/d
         # values. Movements share one column in the data, so
         # direction is represented by a value on either side
         # of the median
 
-        lr_median = self.lr_max/2
-        ud_median = self.ud_max/2
+        lr_median = lr_max//2
+        ud_median = ud_max//2
 
         # If there is movement in the l/r column in the raw data
-        if(self.raw[self.lr_col] > 0):
+        if(raw[lr_col] > 0):
             # Values below the median are right movement
-            if(self.raw[self.lr_col] < lr_median):
-                self.left_right = "Right"
+            if(raw[lr_col] < lr_median):
+                left_right = "Right"
             # Values above the median are left movement
-            elif(self.raw[self.lr_col] > lr_median):
-                self.left_right = "Left"
+            elif(raw[lr_col] > lr_median):
+                left_right = "Left"
 
-        if(self.raw[self.ud_col] > 0):
-            if(self.raw[self.ud_col] < ud_median):
-                self.up_down = "Down"
-            elif(self.raw[self.ud_col] > ud_median):
-                self.up_down = "Up"
+        if(raw[ud_col] > 0):
+            if(raw[ud_col] < ud_median):
+                up_down = "Down"
+            elif(raw[ud_col] > ud_median):
+                up_down = "Up"
 
         # Reverse movement if flag is set
-        if(self.rev_lr == 1 and self.left_right is "Right"):
-            self.left_right = "Left"
-        elif(self.rev_lr == 1 and self.left_right is "Left"):
-            self.left_right = "Right"
+        if(rev_lr == 1 and left_right == "Right"):
+            left_right = "Left"
+        elif(rev_lr == 1 and left_right == "Left"):
+            left_right = "Right"
 
-        if(self.rev_ud == 1 and self.up_down is "Up"):
-            self.up_down = "Down"
-        elif(self.rev_ud == 1 and self.up_down is "Down"):
-            self.up_down = "Up"
+        if(rev_ud == 1 and up_down == "Up"):
+            up_down = "Down"
+        elif(rev_ud == 1 and up_down == "Down"):
+            up_down = "Up"
 
+        return (left_right, up_down)
 
     def analyze_spd(self):
         ''' Determine the speed of movement and represent as a range
             with 0 being no movement, and 100 being maximum recordable
             speed '''
 
-        lr_median = self.lr_max/2
-        ud_median = self.ud_max/2
+        lr_col, ud_col, lr_max, ud_max, rev_lr, rev_ud = self.config
+        raw = bytearray(self.data)
+
+        left_right_spd = 0
+        up_down_spd = 0
+
+        lr_median = lr_max//2
+        ud_median = ud_max//2
 
         # If movement is detected in the l/r column of the raw data
-        if(self.raw[self.lr_col] > 0):
+        if(raw[lr_col] > 0):
             # Values below the median are right movement
-            if(self.raw[self.lr_col] < lr_median):
+            if(raw[lr_col] < lr_median):
                 # Calculate direction, then rate of speed based on range of possible values
-                self.left_right_spd = int(self.raw[self.lr_col]/float(lr_median - 1) * 100)
-            elif(self.raw[self.lr_col] > lr_median):
-                self.left_right_spd = int(((self.lr_max - self.raw[self.lr_col])/float(lr_median - 1)) * 100)
+                left_right_spd = int(raw[lr_col]/float(lr_median - 1) * 100)
+            elif(raw[lr_col] > lr_median):
+                left_right_spd = int(((lr_max - raw[lr_col])/float(lr_median - 1)) * 100)
+
+        if(raw[ud_col] > 0):
+            if(raw[ud_col] < ud_median):
+                up_down_spd = int(raw[ud_col]/float(ud_median - 1) * 100)
+            elif(raw[ud_col] > ud_median):
+                up_down_spd = int(((ud_max - raw[ud_col])/float(ud_median - 1)) * 100)
+
+        return (left_right_spd, up_down_spd)
+
+    def get_delta(self):
+        ''' Return the signed movement in counts as (x, y), with x
+            positive to the right and y positive upward '''
+
+        lr_table, ud_table = self.get_tables()
+        raw = bytearray(self.data)
+
+        return (lr_table[raw[self.config[0]]][2], ud_table[raw[self.config[1]]][2])
+
+    def analyze_delta(self):
+        ''' Use the raw data to determine the signed movement '''
+
+        lr_col, ud_col, lr_max, ud_max, rev_lr, rev_ud = self.config
+        raw = bytearray(self.data)
 
-        if(self.raw[self.ud_col] > 0):
-            if(self.raw[self.ud_col] < ud_median):
-                self.up_down_spd = int(self.raw[self.ud_col]/float(ud_median - 1) * 100)
-            elif(self.raw[self.ud_col] > ud_median):
-                self.up_down_spd = int(((self.ud_max - self.raw[self.ud_col])/float(ud_median - 1)) * 100)
+        d_x = 0
+        d_y = 0
+
+        # Values below the median are right and down movement, values
+        # above it count down from the maximum
+        if(0 < raw[lr_col] < lr_max//2):
+            d_x = raw[lr_col]
+        elif(raw[lr_col] > lr_max//2):
+            d_x = -(lr_max - raw[lr_col])
+
+        if(0 < raw[ud_col] < ud_max//2):
+            d_y = -raw[ud_col]
+        elif(raw[ud_col] > ud_max//2):
+            d_y = ud_max - raw[ud_col]
+
+        # Reverse movement if flag is set
+        if(rev_lr == 1):
+            d_x = -d_x
+        if(rev_ud == 1):
+            d_y = -d_y
+
+        return (d_x, d_y)
 
     def get_raw(self, label=False):
         ''' Return raw data '''
@@ -130,25 +298,34 @@ class Mouse_Movement(object):
         else:
             return "Device: " + str(self.raw)
 
+    def get_time(self):
+        ''' Return the time the data was read '''
+
+        return self.time
+
     def get_dir(self, label=False):
         ''' Return movement direction. The label flag will
             label data by device. '''
 
+        decoded = self.decode()
+
         if(label is False):
-            return (self.left_right, self.up_down)
+            return (decoded[0], decoded[1])
         else:
-            return("Device: " + str(self.device), self.left_right,
-                   self.up_down)
+            return("Device: " + str(self.device), decoded[0],
+                   decoded[1])
 
     def get_spd(self, label=False):
         ''' Return movement direction '''
 
+        decoded = self.decode()
+
         if(label is False):
-            return(self.left_right_spd, self.up_down_spd)
+            return(decoded[2], decoded[3])
         else:
             return("Device: " + str(self.device),
-                   self.left_right_spd,
-                   self.up_down_spd)
+                   decoded[2],
+                   decoded[3])
 
     def get_data(self, label=False):
         ''' Return movement data '''
@@ -165,14 +342,82 @@ class Mouse_Movement(object):
         else:
             return("Device: " + str(self.device), data)
 
+class HID_Movement(Mouse_Movement):
+    ''' A movement decoded with the report layout given by the
+        device's HID report descriptor, for mice whose movement is
+        signed, wider than a byte or after a report ID. rev_lr and
+        rev_ud apply; the column and range parameters are not used. '''
+
+    __slots__ = ('fields', 'layout')
+
+    def __init__(self, device, data_list, layout, **config):
+        Mouse_Movement.__init__(self, device, data_list, **config)
+
+        self.layout = layout                    # Report_Layout of the device
+        self.fields = layout.decode(self.data)  # (buttons, x, y, wheel)
+
+    def decode(self):
+        ''' Derive directions and speeds from the signed movement '''
+
+        if(self.decoded is None):
+            d_x, d_y = self.get_delta()
+
+            left_right = "None"
+            up_down = "None"
+
+            if(d_x > 0):
+                left_right = "Right"
+            elif(d_x < 0):
+                left_right = "Left"
+
+            if(d_y > 0):
+                up_down = "Up"
+            elif(d_y < 0):
+                up_down = "Down"
+
+            # Speed is a percentage of the largest one byte movement
+            self.decoded = (left_right, up_down,
+                            min(100, int(abs(d_x) / float(self.layout.x_max) * 100)),
+                            min(100, int(abs(d_y) / float(self.layout.y_max) * 100)))
+
+        return self.decoded
+
+    def get_delta(self):
+        ''' Return the signed movement in counts as (x, y), with x
+            positive to the right and y positive upward '''
+
+        # Reports count y downward
+        d_x = self.fields[1]
+        d_y = -self.fields[2]
+
+        # Reverse movement if flag is set
+        if(self.config[4] == 1):
+            d_x = -d_x
+        if(self.config[5] == 1):
+            d_y = -d_y
+
+        return (d_x, d_y)
+
+    def get_buttons(self):
+        ''' Return the pressed buttons as a bit mask '''
+
+        return self.fields[0]
+
+    def get_wheel(self):
+        ''' Return the signed wheel movement '''
+
+        return self.fields[3]
+
 class USB_Mouse(object):
     ''' Read USB Mouse tracking data '''
 
     # Class Variables - (Shared by all instances)
     num_con_devices = 0
     con_devices = []
+    device_index = None     # Device_Index shared by non-interactive connects
+    profiles = None         # Profile_Registry of known mouse models
 
-    def __init__(self):
+    def __init__(self, transport=None, capacity=65536, policy=DROP_OLDEST):
         self.prod_id = -1   # Device product ID
         self.vendor = -1    # Device vendor ID
         self.device = -1    # A usb.core device object placeholder
@@ -180,27 +425,61 @@ class USB_Mouse(object):
         self.num = -1       # Class ID for classes with connected devices
         self.index = -1     # Index in connected devices list
         self.interface = 0  # Device constant
+        self.bus = -1       # USB bus number of a physical device
+        self.address = -1   # USB address of a physical device
 
-        self.movements = Queue.Queue()  # Recorded movements
-        self.event = Event()            # Shared variable to synchronize threads
+        # Source of reports, a physical mouse by default
+        if(transport is None):
+            transport = PyUSB_Transport()
+        self.transport = transport
 
-    def connect(self, gui=0, guids=[[], []]):
-        ''' Take control of the device and read data '''
+        # Mouse_Movement parameters (lr_col, ud_col, lr_max, ud_max, rev_lr, rev_ud)
+        self.movement_config = {}
 
-        # Find the device to attach to
-        ids = self.find_device(gui, guids)
+        self.movements = Ring_Buffer(capacity, policy)  # Recorded movements
+        self.event = Event()            # Shared variable to synchronize threads
+        self.threads = []               # Threads and processes started by read()
+        self.reading = False            # A thread or process is reading this device
+        self.capture = None             # Capture process in multiprocess mode
+        self.capture_event = None       # Shared variable to synchronize capture processes
+        self.read_devices = []          # Devices started by read()
+        self.stages = []                # Stages given each movement read
+        self.motion = None              # Motion_Accumulator when tracking
+        self.timing = Timing_Stats()    # Inter-report timing
+        self.stats = Device_Stats()     # Reading thread counters
+        self.tracer = None              # Latency_Tracer when tracing
+        self.layout = None              # Report_Layout from the HID report descriptor
+
+    def connect(self, gui=0, guids=[[], []], vendor=None, product=None, bus=None,
+                address=None):
+        ''' Take control of the device and read data. If any of vendor,
+            product, bus or address are set the first unconnected device
+            matching them is used without prompting '''
+
+        location = (None, None)
+
+        # Virtual transports know their IDs, otherwise find the device to attach to
+        if(self.transport.ids is not None):
+            ids = ([self.transport.ids[0]], [self.transport.ids[1]])
+        elif(vendor is not None or product is not None or bus is not None or address is not None):
+            ids, location = self.find_indexed(vendor, product, bus, address, gui)
+        else:
+            ids = self.find_device(gui, guids)
 
-        if(ids < 0):
+        if(isinstance(ids, int) and ids < 0):
             if(gui == 0):
                 print("Failed to connect to a device...")
             return ids
 
         self.vendor = ids[0][0]
         self.prod_id = ids[1][0]
-        self.device = usb.core.find(idVendor=self.vendor, idProduct=self.prod_id)
 
         # Take control from the kernel
-        self.claim_device()
+        if(self.transport.open(self.vendor, self.prod_id, *location)):
+            self.device = self.transport.device
+            self.bus = getattr(self.device, "bus", -1)
+            self.address = getattr(self.device, "address", -1)
+            self.claim_device()
 
         # Check success
         if (self.prod_id == -1 or self.device == -1 or self.vendor == -1):
@@ -208,6 +487,10 @@ class USB_Mouse(object):
                 print("No device attached!")
             return -2
 
+        # Known models start with their stored parameters
+        if(len(self.movement_config) == 0):
+            self.load_profile()
+
         # Update shared number of connected devices
         self.num = USB_Mouse.num_con_devices
         USB_Mouse.num_con_devices += 1
@@ -219,18 +502,163 @@ class USB_Mouse(object):
         if(gui == 0):
             print("Device " + str(self.num) + " connected")
 
-    def getDeviceIDs(self):
-        ''' Get all connected devices '''
+    @staticmethod
+    def get_index():
+        ''' Return the shared Device_Index, enumerating the bus on first use '''
+
+        if(USB_Mouse.device_index is None):
+            USB_Mouse.device_index = Device_Index()
+
+        return USB_Mouse.device_index
+
+    @staticmethod
+    def in_use():
+        ''' Return the (bus, address) of every connected device '''
+
+        return set((device.bus, device.address) for device in USB_Mouse.con_devices)
+
+    def find_indexed(self, vendor, product, bus, address, gui=0):
+        ''' Find an unconnected device in the index. Returns the IDs and
+            (bus, address) of the device, or -2 and None if none match '''
+
+        in_use = USB_Mouse.in_use()
+
+        for entry in USB_Mouse.get_index().find(vendor, product, bus, address):
+            if((entry.bus, entry.address) not in in_use):
+                return ([entry.vendor], [entry.product]), (entry.bus, entry.address)
+
+        if(gui == 0):
+            print("No matching device found!")
+        return -2, None
+
+    @staticmethod
+    def connect_all(match=is_mouse, gui=0, **kwargs):
+        ''' Connect every attached device accepted by match(entry) that
+            is not already connected. By default all mice are connected.
+            kwargs are passed to each USB_Mouse. Returns the connected
+            USB_Mouse objects '''
+
+        devices = []
+        in_use = USB_Mouse.in_use()
+
+        for entry in USB_Mouse.get_index().find(match=match):
+            if((entry.bus, entry.address) in in_use):
+                continue
+
+            device = USB_Mouse(**kwargs)
+            if(device.connect(gui, vendor=entry.vendor, product=entry.product,
+                              bus=entry.bus, address=entry.address) is None):
+                devices.append(device)
+
+        return devices
+
+    @staticmethod
+    def auto_connect(callback, match=is_mouse, gui=0, **kwargs):
+        ''' Connect devices accepted by match(entry) as they are
+            attached and pass each USB_Mouse to callback. Returns the
+            listener, or None if hotplug is unavailable. Requires
+            python-libusb1 '''
+
+        def listener(entry, attached):
+            if(attached and match(entry) and (entry.bus, entry.address) not in USB_Mouse.in_use()):
+                device = USB_Mouse(**kwargs)
+                if(device.connect(gui, vendor=entry.vendor, product=entry.product,
+                                  bus=entry.bus, address=entry.address) is None):
+                    callback(device)
+
+        index = USB_Mouse.get_index()
+        if(not index.add_listener(listener)):
+            index.remove_listener(listener)
+            return None
+
+        return listener
+
+    @staticmethod
+    def get_profiles():
+        ''' Return the shared Profile_Registry '''
+
+        if(USB_Mouse.profiles is None):
+            USB_Mouse.profiles = Profile_Registry()
+
+        return USB_Mouse.profiles
+
+    def load_profile(self):
+        ''' Use the stored parameters of the device's model if known.
+            Returns True if a profile was loaded '''
+
+        config = USB_Mouse.get_profiles().get(self.vendor, self.prod_id)
+        if(config is None):
+            return False
+
+        self.movement_config = config
+        return True
+
+    def calibrate(self, samples=50, timeout=30, prompt=None, save=True):
+        ''' Infer the Mouse_Movement parameters of the device from
+            guided movement and use them. The device is read while the
+            user moves the mouse right, left, up and down, one phase at
+            a time. prompt(phase) is called before each phase and asks
+            on the console by default. If save is set the parameters are
+            stored for the device's model. Returns the parameters, or
+            -1 on failure '''
+
+        # Check for connected device
+        if(self.prod_id == -1 or self.device == -1 or self.vendor == -1):
+            print("No device attached!")
+            return -1
+
+        if(prompt is None):
+            def prompt(phase):
+                input("Press Enter, then move the mouse " + phase + " until told to stop >>> ")
+
+        calibrator = Calibrator(samples, layout=self.layout)
+        self.add_stage(calibrator)
+        self.read(verbosity=0, sync=False)
+
+        try:
+            for phase in PHASES:
+                prompt(phase)
+                calibrator.start(phase)
+
+                deadline = time.time() + timeout
+                while(not calibrator.ready() and time.time() < deadline):
+                    time.sleep(0.05)
+
+                ready = calibrator.ready()
+                calibrator.start(None)
+
+                if(not ready):
+                    print("Calibration timed out!")
+                    return -1
+
+                print("Stop")
+
+        finally:
+            self.stop()
+            self.remove_stage(calibrator)
+
+        config = calibrator.result()
+        if(config is None):
+            print("Calibration failed, movement was unclear!")
+            return -1
+
+        # With a layout only the directions are inferred
+        if(self.layout is not None):
+            config = dict(self.movement_config, **config)
 
-        dev_ids = [[], []]
-        devices = usb.core.find(find_all=True)
+        # Movements read so far used the old parameters
+        self.movements.clear()
+        self.movement_config = config
 
-        # Store a list of all attached vendor and product IDs
-        for cfg in devices:
-            dev_ids[0].append(int(cfg.idVendor))
-            dev_ids[1].append(int(cfg.idProduct))
+        if(save):
+            USB_Mouse.get_profiles().set(self.vendor, self.prod_id, config)
 
-        return dev_ids
+        return config
+
+    def getDeviceIDs(self):
+        ''' Get all connected devices '''
+
+        return self.transport.get_device_ids()
 
     def find_device(self, gui=0, guids=[[], []]):
         ''' Find a USB device '''
@@ -238,9 +666,9 @@ class USB_Mouse(object):
         final = []
 
         if(gui == 0): # Already ran in GUI wrapper
-            raw_input("Ensure the device is disconnected and press Enter >>> ")
+            input("Ensure the device is disconnected and press Enter >>> ")
             guids = self.getDeviceIDs()
-            raw_input("Please connect the USB device and press Enter >>> ")
+            input("Please connect the USB device and press Enter >>> ")
 
         # Store a second list of all attached vendor and product IDs
         with_attach = self.getDeviceIDs()
@@ -253,7 +681,7 @@ class USB_Mouse(object):
         # Verify results
         result = self.verify_device(final, gui)
 
-        if(result < 0):
+        if(isinstance(result, int) and result < 0):
             return result
 
         return (result[0], result[1])
@@ -283,7 +711,7 @@ class USB_Mouse(object):
 
         if(flag != 0):
             if(gui == 0):
-                val = raw_input("Press Enter to restart or \'q\' to quit >>> ")
+                val = input("Press Enter to restart or \'q\' to quit >>> ")
                 if(val == 'q'):
                     return -1
                 else:
@@ -296,15 +724,16 @@ class USB_Mouse(object):
     def claim_device(self):
         ''' Claim the device from the kernel '''
 
-       # Set endpoint
-        self.endpoint = self.device[0][(0, 0)][0]
+        self.transport.claim(self.interface)
 
-        # If the device is being used by the kernel
-        if(self.device.is_kernel_driver_active(self.interface)) is True:
-            self.device.detach_kernel_driver(self.interface)
+        # Set endpoint
+        self.endpoint = self.transport.endpoint
 
-        # Claim the device
-        usb.util.claim_interface(self.device, self.interface)
+        # Decode reports with the layout the device describes, if any.
+        # Replayed devices give their recorded layout
+        self.layout = self.transport.layout
+        if(self.layout is None):
+            self.layout = parse_layout(self.transport.get_report_descriptor(self.interface))
 
     def read_thread_loop(self, event):
         ''' Reads data from a device until signaled. '''
@@ -312,22 +741,70 @@ class USB_Mouse(object):
         # Check for connected device
         if(self.prod_id == -1 or self.device == -1 or self.vendor == -1):
             print("No device attached!")
+            self.reading = False
             return -1
 
+        try:
+            self.read_reports(event)
+        finally:
+            self.reading = False
+
+    def read_reports(self, event):
+        ''' Read reports into the movement buffer until signaled '''
+
+        # Time between reads is not an interval
+        self.timing.set_interval(self.transport.interval)
+        self.timing.restart()
+        self.stats.start()
+
         # Loop data read until interrupt
         while (event.is_set()):
             try:
-                data_list = self.device.read(self.endpoint.bEndpointAddress, 8).tolist()
+                data_list = self.transport.read()
+                read = monotonic_ns()
+
+                # Nothing arrived before the timeout
+                if(data_list is None):
+                    self.stats.timeouts += 1
+                    continue
+
+                # Reports from queued transfers carry their transfer time
+                now = self.transport.arrived
+                if(now is None):
+                    now = read
 
                 # If data is in proper format, analyze movement
-                if(len(data_list) == 8):
-                    movement = Mouse_Movement(self.num, data_list)
-                    self.movements.put(movement, block=False)
+                movement = self.report_movement(data_list, now / 1e9)
+                built = monotonic_ns()
+                self.stats.add_report(built - read)
 
-            except usb.core.USBError as error:
-                if error.args == ('Operation timed out',):
+                if(movement is None):
+                    self.stats.rejected += 1
                     continue
 
+                self.timing.add(now)
+                tracer = self.tracer
+
+                if(tracer is None):
+                    self.movements.put(movement)
+
+                    for stage in self.stages:
+                        stage.write(self, movement)
+
+                # Time each stage of the capture path
+                else:
+                    movement.trace = (now, built)
+                    self.movements.put(movement)
+                    stored = monotonic_ns()
+
+                    for stage in self.stages:
+                        stage.write(self, movement)
+
+                    tracer.captured(now, built, stored, monotonic_ns())
+
+            except Transport_Error as error:
+                self.stats.add_error(error.errno)
+
             # For keyboard interrupt
             except KeyboardInterrupt:
                 print("Read interrupted by user. Exiting.")
@@ -335,22 +812,131 @@ class USB_Mouse(object):
                 return
 
     def print_thread_loop(self, devices, label, verbosity, event):
-        ''' Thread to print readings from devices'''
+        ''' Thread to print readings from devices in the order they
+            were captured. Sleeps until at least one device has data. '''
+
+        merged = Merged_Stream(devices, label=label, verbosity=verbosity)
 
         while (event.is_set()):
-            movements = []
-            for device in devices:
-                if (device.movements.empty() is False):
-                    movement = device.get_movement(label, verbosity)
-                    if (movement is not None):
-                        movements.append(movement)
+            movements = [merged.format(index, movement) for index, movement in merged.drain()]
 
             if (len(movements) > 0):
-                print movements
+                print(movements)
+                continue
+
+            # Wake periodically to check the event
+            delay = merged.delay()
+            merged.wait(0.5 if delay is None else min(delay, 0.5))
+
+    def report_movement(self, report, timestamp):
+        ''' Build the movement of a report. Returns None if the report
+            does not hold movement '''
+
+        # Transports that read lists are copied once
+        if(not isinstance(report, bytes)):
+            report = bytes(bytearray(report))
+
+        if(self.layout is not None):
+            if(self.layout.matches(report)):
+                return HID_Movement(self.num, report, self.layout, timestamp=timestamp, **self.movement_config)
+            return None
+
+        # Reports must reach the movement columns
+        if(len(report) > max(self.movement_config.get("lr_col", 1), self.movement_config.get("ud_col", 2))):
+            return Mouse_Movement(self.num, report, timestamp=timestamp, **self.movement_config)
+
+        return None
+
+    def make_movement(self, data, timestamp, decoded):
+        ''' Rebuild a movement decoded by a capture process '''
+
+        if(self.layout is not None):
+            movement = HID_Movement(self.num, data, self.layout, timestamp=timestamp, **self.movement_config)
+        else:
+            movement = Mouse_Movement(self.num, data, timestamp=timestamp, **self.movement_config)
+
+        movement.decoded = decoded
+        return movement
+
+    def start_capture_process(self, event):
+        ''' Read and decode the device in its own process. Movements
+            come back through a Shared_Ring that replaces the movement
+            buffer until the next threaded read '''
 
-    def read(self, devices=None, label=False, verbosity=2, gui=0):
+        capacity, policy = self.movements.capacity, self.movements.policy
+        self.movements.close()
+        self.movements = Shared_Ring(capacity, policy, self.make_movement)
+
+        # The capture process claims the interface itself
+        self.transport.release(self.interface)
+
+        self.capture = Capture_Process(target=self.capture_process_loop, args=(event,))
+        self.capture.daemon = True
+        self.capture.start()
+
+        return self.capture
+
+    def capture_process_loop(self, event):
+        ''' Claim, read and decode the device until signaled. Runs in
+            the capture process '''
+
+        self.transport.claim(self.interface)
+
+        try:
+            while (event.is_set()):
+                try:
+                    data_list = self.transport.read()
+                    now = monotonic_ns()
+
+                    if(data_list is None):
+                        continue
+
+                    # Reports from queued transfers carry their transfer time
+                    if(self.transport.arrived is not None):
+                        now = self.transport.arrived
+
+                    movement = self.report_movement(data_list, now / 1e9)
+
+                    # Decode here so the parent only unpacks records
+                    if(movement is not None):
+                        movement.decode()
+                        self.movements.write(movement, event)
+
+                except Transport_Error:
+                    pass
+
+        # Interrupts are handled by the parent
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            self.transport.release(self.interface)
+
+    def stop_capture_process(self):
+        ''' Wait for the capture process to exit and take the
+            interface back '''
+
+        self.capture.join()
+        self.capture = None
+        self.reading = False
+        self.transport.claim(self.interface)
+
+    def use_ring_buffer(self):
+        ''' Swap a Shared_Ring left by a multiprocess read back to a
+            Ring_Buffer '''
+
+        if(isinstance(self.movements, Shared_Ring)):
+            capacity, policy = self.movements.capacity, self.movements.policy
+            self.movements.close()
+            self.movements = Ring_Buffer(capacity, policy)
+
+    def read(self, devices=None, label=False, verbosity=2, gui=0, sync=True,
+             processes=False):
         ''' Read one or more devices concurrently. If the label flag is set,
-            the data read will be labeled by device'''
+            the data read will be labeled by device. If sync is False the
+            read continues in the background until stop() is called. If
+            processes is set each device is read and decoded in its own
+            process instead of a thread '''
 
         # If no list passed
         if(devices is None):
@@ -362,11 +948,34 @@ class USB_Mouse(object):
 
         threads = []
 
-        # Synchronize with event
+        # Stages run in the reading threads
+        if(processes and any(device.stages for device in devices)):
+            print("Stages are not supported with processes!")
+            return -1
+
+        # Shared_Ring records hold 8 byte reports
+        if(processes and any(device.layout is not None and device.layout.size > 8 for device in devices)):
+            print("Reports longer than 8 bytes are not supported with processes!")
+            return -1
+
+        # Capture processes cannot see self.event
+        if(processes):
+            self.capture_event = multiprocessing.Event()
+            self.capture_event.set()
+
+        # Synchronize with event, only once the read can start
         self.event.set()
 
         # Start and store all threads
         for device in devices:
+            device.reading = True
+
+            if(processes):
+                threads.append(device.start_capture_process(self.capture_event))
+                continue
+
+            device.use_ring_buffer()
+            device.movements.resume()
             thread = Thread(target=device.read_thread_loop, args=(self.event,))
             threads.append(thread)
             thread.start()
@@ -377,23 +986,51 @@ class USB_Mouse(object):
             threads.append(print_thread)
             print_thread.start()
 
+        self.threads = threads
+        self.read_devices = devices
+
+        # Leave the threads running in the background
+        if(gui == 1 or sync is False):
+            return
+
         # Synchronized thread kill on keyboard interrupt (CTRL+C)
         try:
-            while(1):
-                if(gui == 1):
-                    break
+            while(self.event.is_set() and any(thread.is_alive() for thread in threads)):
+                time.sleep(0.5)
 
         except KeyboardInterrupt:
             print("Read interrupted by user. Exiting.")
-            self.event.clear()
-            [thread.join() for thread in threads]
+
+        self.stop()
+
+    def stop(self):
+        ''' Stop a read and wait for its threads to finish '''
+
+        self.event.clear()
+        if(self.capture_event is not None):
+            self.capture_event.clear()
+
+        # Reading threads may be waiting for space in a full buffer
+        for device in self.read_devices:
+            if(isinstance(device.movements, Ring_Buffer)):
+                device.movements.interrupt()
+
+        [thread.join() for thread in self.threads]
+
+        for device in self.read_devices:
+            if(device.capture is not None):
+                device.stop_capture_process()
+
+        self.threads = []
+        self.read_devices = []
+        self.capture_event = None
 
     # Thanks to: https://stackoverflow.com/questions/11436502/closing-all-threads-with-a-keyboard-interrupt
 
-    def read_all(self, label=True, verbosity=2):
+    def read_all(self, label=True, verbosity=2, sync=True):
         ''' Read all connected devices concurrently '''
 
-        self.read(self.get_devices(), label, verbosity)
+        self.read(self.get_devices(), label, verbosity, sync=sync)
 
     def disconnect(self):
         ''' Release the device to the kernel '''
@@ -404,10 +1041,7 @@ class USB_Mouse(object):
             return -1
 
         # Release device
-        usb.util.release_interface(self.device, self.interface)
-
-        if(self.device.is_kernel_driver_active(self.interface)) is False:
-            self.device.attach_kernel_driver(self.interface)
+        self.transport.release(self.interface)
 
         # Remove from shared connected device list and adjust indices
         for device in range(self.index + 1, self.num_con_devices):
@@ -420,7 +1054,8 @@ class USB_Mouse(object):
         # Reinitialize for reuse
         print("Device " + str(self.num) + " disconnected")
 
-        self.__init__()
+        self.movements.close()
+        self.__init__(self.transport, self.movements.capacity, self.movements.policy)
 
     def get_info(self):
         ''' Return info '''
@@ -428,22 +1063,334 @@ class USB_Mouse(object):
         return [("Number", self.num), ("Index", self.index),
                 ("Product_ID", self.prod_id),
                 ("Vendor_ID", self.vendor),
-                ("Total_Devices", USB_Mouse.num_con_devices)]
+                ("Total_Devices", USB_Mouse.num_con_devices),
+                ("Bus", self.bus), ("Address", self.address)]
+
+    def get_timing(self):
+        ''' Return inter-report timing statistics as a list of tuples
+            containing the number of reports, effective polling rate,
+            nominal interval, interval and jitter percentiles, gaps,
+            estimated missed polls and idle periods '''
+
+        return self.timing.get_stats()
+
+    def get_stats(self):
+        ''' Return reading thread counters as a list of tuples
+            containing reports read, reports per second, timeouts,
+            errors by errno, reports without movement, mean time to
+            build a movement in microseconds, buffer depth and high
+            water mark, and movements dropped by a full buffer '''
+
+        return [("Reports", self.stats.reports),
+                ("Reports_Per_Sec", self.stats.get_rate()),
+                ("Timeouts", self.stats.timeouts),
+                ("Errors", dict(self.stats.errors)),
+                ("Rejected", self.stats.rejected),
+                ("Build_us", self.stats.get_build_us()),
+                ("Queue_Depth", self.movements.qsize()),
+                ("High_Water", self.movements.high_water),
+                ("Dropped", self.movements.overflows)]
+
+    @staticmethod
+    def serve_stats(port=9464, host="127.0.0.1", devices=None):
+        ''' Serve get_stats() of the connected devices, or of the given
+            devices, in the Prometheus text format at
+            http://host:port/metrics. Returns the Stats_Server; call
+            stop() on it to shut it down '''
+
+        if(devices is None):
+            return Stats_Server(lambda: list(USB_Mouse.con_devices), port, host)
+
+        return Stats_Server(lambda: devices, port, host)
 
-    def get_movement(self, label=False, verbosity=2):
-        ''' Get the current movement '''
+    def trace_latency(self, enable=True):
+        ''' Start or stop timing each stage between the USB read
+            returning and the consumer taking the movement. Starting
+            clears earlier timings. Threaded reads only '''
+
+        self.tracer = Latency_Tracer() if enable else None
+
+    def get_latency(self):
+        ''' Return the latency of each stage as a list of tuples
+            (stage, count, p50, p99, p99.9, max) in microseconds, or
+            None if not tracing '''
+
+        if(self.tracer is None):
+            return None
+
+        return self.tracer.get_stats()
+
+    def get_queue_info(self):
+        ''' Return movement buffer info '''
+
+        return [("Capacity", self.movements.capacity),
+                ("Policy", self.movements.policy),
+                ("Depth", self.movements.qsize()),
+                ("High_Water", self.movements.high_water),
+                ("Overflows", self.movements.overflows)]
+
+    def format_movement(self, movement, label, verbosity):
+        ''' Represent a movement based on the verbosity parameter '''
 
         # If verbosity is 1
         # Return raw data
         if(verbosity == 1):
-            movement = self.movements.get(block=False).get_raw(label)
-            return movement
+            return movement.get_raw(label)
 
         # If verbosity is 2
         # Return verbose data
         elif(verbosity == 2):
-            movement = self.movements.get(block=False).get_data(label)
-            return movement
+            return movement.get_data(label)
+
+        return movement
+
+    def get_movement(self, label=False, verbosity=2, timeout=0):
+        ''' Get the current movement. Waits up to timeout seconds for
+            one to arrive (forever if None). Returns None if no
+            movement is available '''
+
+        if(verbosity not in (1, 2)):
+            return None
+
+        tracer = self.tracer
+        if(tracer is not None):
+            tracer.started(monotonic_ns())
+
+        try:
+            movement = self.movements.get(timeout != 0, timeout)
+        except Queue.Empty:
+            return None
+
+        if(tracer is not None):
+            tracer.taken((movement,), monotonic_ns())
+
+        return self.format_movement(movement, label, verbosity)
+
+    def get_movements(self, max_n=None, timeout=0):
+        ''' Drain up to max_n queued movements (all if None) into a
+            Movement_Batch decoded in one vectorized pass. Waits up to
+            timeout seconds for the first movement (forever if None) '''
+
+        if(Movement_Batch is None):
+            raise ImportError("NumPy is required for batch decoding")
+
+        tracer = self.tracer
+        if(tracer is not None):
+            tracer.started(monotonic_ns())
+
+        movements = self.movements.get_many(max_n, timeout != 0, timeout)
+
+        if(tracer is not None):
+            tracer.taken(movements, monotonic_ns())
+
+        # Reports are cut to the layout's length, or decoded by column
+        if(self.layout is not None):
+            size = self.layout.size
+            reports = b''.join([movement.data[:size] for movement in movements])
+        else:
+            reports = b''.join([movement.data for movement in movements])
+
+        return Movement_Batch(self.num, reports, self.layout, **self.movement_config)
+
+    def iter_movements(self, label=False, verbosity=0, timeout=None):
+        ''' Yield movements as they arrive, sleeping while the device
+            is idle. Stops once the device is no longer being read and
+            its buffer is empty, or when no movement arrives within
+            timeout seconds. A verbosity of 0 yields Mouse_Movement
+            objects '''
+
+        while(True):
+            tracer = self.tracer
+            if(tracer is not None):
+                tracer.started(monotonic_ns())
+
+            # Wake periodically to check whether the read has stopped
+            try:
+                movement = self.movements.get(True, 0.5 if timeout is None else timeout)
+            except Queue.Empty:
+                if(timeout is not None or self.reading is False):
+                    return
+                continue
+
+            if(tracer is not None):
+                tracer.taken((movement,), monotonic_ns())
+
+            yield self.format_movement(movement, label, verbosity)
+
+    def next_movement(self, label=False, verbosity=0, timeout=None):
+        ''' Return an awaitable for the next movement of the device.
+            Requires Python 3.5+ '''
+
+        if(Movement_Stream is None):
+            raise RuntimeError("asyncio streaming requires Python 3.5+")
+
+        return next_movement(self, label, verbosity, timeout)
+
+    @staticmethod
+    def stream(devices=None, label=False, verbosity=0):
+        ''' Return an asynchronous iterator over the movements of the
+            devices (all connected devices if None). Requires
+            Python 3.5+ '''
+
+        if(Movement_Stream is None):
+            raise RuntimeError("asyncio streaming requires Python 3.5+")
+
+        if(devices is None):
+            devices = USB_Mouse.con_devices
+
+        return Movement_Stream(list(devices), label, verbosity)
+
+    @staticmethod
+    def merged(devices=None, window=0.005, label=False, verbosity=0):
+        ''' Return a Merged_Stream that yields the movements of the
+            devices (all connected devices if None) in capture time
+            order. A movement is held for up to window seconds so
+            movements read late from other devices can be placed before
+            it. Use slots(period) on the stream for one sample per
+            device per time slot '''
+
+        if(devices is None):
+            devices = USB_Mouse.con_devices
+
+        return Merged_Stream(list(devices), window, label, verbosity)
+
+    def add_stage(self, stage):
+        ''' Give every movement read from the device to a stage. A
+            stage has a write(device, movement) method called by the
+            reading thread '''
+
+        if(stage not in self.stages):
+            self.stages.append(stage)
+
+    def remove_stage(self, stage):
+        ''' Stop giving movements to a stage '''
+
+        if(stage in self.stages):
+            self.stages.remove(stage)
+
+    def track_motion(self, window=0.05):
+        ''' Start accumulating position, velocity and acceleration from
+            every movement read. window = seconds of history used for
+            windowed velocity and acceleration '''
+
+        if(self.motion is not None):
+            self.remove_stage(self.motion)
+
+        self.motion = Motion_Accumulator(window, monotonic)
+        self.add_stage(self.motion)
+
+    def get_motion(self):
+        ''' Return the current motion state as a list of tuples
+            containing the time of the last movement, position,
+            velocity, windowed velocity and acceleration. Does not
+            consume movements. Returns None if motion is not tracked '''
+
+        if(self.motion is None):
+            return None
+
+        return self.motion.get_state()
+
+    def track_odometry(self, other, positions, angles=(0.0, 0.0), resolution=1.0,
+                       period=0.002):
+        ''' Start estimating the pose of a body carrying this device and
+            another. positions = ((x, y), (x, y)) of this device and the
+            other in the body frame, angles = rotation of each device's
+            x axis from the body x axis in radians, resolution = counts
+            per unit of distance, period = seconds per step. Returns the
+            Odometry stage, which stops when closed '''
+
+        odometry = Odometry([self, other], positions, angles, resolution, period,
+                            clock=monotonic)
+
+        self.add_stage(odometry)
+        other.add_stage(odometry)
+
+        return odometry
+
+    def record(self, path, devices=None, chunked=False, chunk_size=4096):
+        ''' Record the movements of the devices (this device if None)
+            to a session file. If chunked is set the file is written in
+            chunks of chunk_size records with a time index. Returns the
+            recorder, which stops recording when closed '''
+
+        if(devices is None):
+            devices = [self]
+
+        if(chunked):
+            recorder = Chunked_Recorder(path, devices, chunk_size)
+        else:
+            recorder = Session_Recorder(path, devices)
+
+        for device in devices:
+            device.add_stage(recorder)
+
+        return recorder
+
+    def publish(self, host, port, devices=None, protocol="udp", batch=64, latency=0.01):
+        ''' Send the movements of the devices (this device if None) to
+            a subscriber at host and port over UDP or TCP, batch
+            movements per message. A movement waits at most latency
+            seconds for its batch. Returns the publisher, which stops
+            sending when closed '''
+
+        if(devices is None):
+            devices = [self]
+
+        publisher = Movement_Publisher((host, port), devices, protocol, batch, latency)
+
+        for device in devices:
+            device.add_stage(publisher)
+
+        return publisher
+
+    @staticmethod
+    def subscribe(port, host="127.0.0.1", protocol="udp", capacity=65536):
+        ''' Receive movements sent by publish(). Returns a
+            Movement_Subscriber whose get_movement(), get_movements()
+            and iteration give Mouse_Movement objects '''
+
+        return Movement_Subscriber(port, host, protocol, capacity, movement=Mouse_Movement)
+
+    def share(self, name=None, capacity=65536):
+        ''' Publish the movements of this device to a named shared
+            memory stream (usb_mouse_<number> if None) that any number
+            of local processes can read with attach_stream(). Returns
+            the writer, which removes the stream when closed '''
+
+        if(name is None):
+            name = "usb_mouse_" + str(self.num)
+
+        writer = Shared_Stream_Writer(name, self, capacity)
+        self.add_stage(writer)
+
+        return writer
+
+    @staticmethod
+    def attach_stream(name, start="latest"):
+        ''' Read a stream published by share(), possibly from another
+            process. Returns a Shared_Stream_Reader with its own cursor
+            whose get_movement(), get_movements() and iteration give
+            Mouse_Movement objects '''
+
+        return Shared_Stream_Reader(name, start, movement=Mouse_Movement)
+
+    @staticmethod
+    def from_session(session, index, speed=1.0):
+        ''' Return a USB_Mouse that replays one device of a session
+            file (a path, Session_Reader or Chunked_Session) with its
+            original timing and configuration. Connect and read it like
+            any device '''
+
+        if(not isinstance(session, (Session_Reader, Chunked_Session))):
+            try:
+                session = Session_Reader(session)
+            except ValueError:
+                session = Chunked_Session(session)
+
+        device = USB_Mouse(session.transport(index, speed=speed))
+        device.movement_config = dict(session.devices[index]["config"])
+
+        return device
 
     def get_devices(self):
         ''' Return a list of all USB_Mouse objects paired with a physical device'''
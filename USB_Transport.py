@@ -0,0 +1,468 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Transport backends used by USB_Mouse to talk to a
+    device. The pyusb transport reads a physical mouse, the replay
+    transport plays back recorded reports with their original timing,
+    and the synthetic transport generates reports at a fixed rate so
+    the pipeline can be exercised without hardware or root.
+
+    Version: Python 2.7 '''
+
+from threading import Thread
+import array
+import math
+import random
+import time
+from Ring_Buffer import Ring_Buffer, DROP_OLDEST
+from Report_Timing import monotonic_ns
+
+# pyusb is only needed for physical devices
+try:
+    import usb.core
+    import usb.util
+except ImportError:
+    usb = None
+
+# Copies an array's contents into a bytes object
+if(hasattr(array.array, 'tobytes')):
+    array_bytes = array.array.tobytes
+else:
+    array_bytes = array.array.tostring     # Python 2
+
+# Interrupt endpoint polling intervals count frames (1 ms) at low and full
+# speed, and 2^(bInterval - 1) microframes (125 us) at high speed and above
+SPEED_HIGH = 3
+
+class Transport_Error(Exception):
+    ''' Raised when a transport fails to claim or read a device '''
+
+    def __init__(self, message, errno=None):
+        Exception.__init__(self, message)
+        self.errno = errno      # Underlying error number if known
+
+class USB_Transport(object):
+    ''' Interface between USB_Mouse and a source of mouse reports.
+
+        Subclasses override open(), read() and optionally
+        get_device_ids(), claim() and release(). Virtual transports set
+        ids to a (vendor, product) tuple so USB_Mouse can connect
+        without prompting for a physical device. '''
+
+    ids = None              # (vendor, product) of a virtual device
+    interval = None         # Polling interval in milliseconds if known
+    default_timeout = 1000  # Read timeout in milliseconds
+    report_size = 8         # Read size when the endpoint does not say
+    report_descriptor = None    # HID report descriptor of a virtual device
+    layout = None           # Report_Layout of a virtual device, used
+                            # instead of its descriptor
+    arrived = None          # monotonic_ns() when the last report read was
+                            # transferred, None if read() returned it at once
+
+    def __init__(self):
+        self.device = -1    # Underlying device handle placeholder
+        self.endpoint = -1  # Endpoint placeholder
+
+    def get_device_ids(self):
+        ''' Return [[vendor IDs], [product IDs]] of attached devices '''
+
+        return [[], []]
+
+    def open(self, vendor, prod_id, bus=None, address=None):
+        ''' Open the device, at the given bus and address if set.
+            Return True on success '''
+
+        raise NotImplementedError
+
+    def claim(self, interface):
+        ''' Take control of the device from the kernel '''
+
+        pass
+
+    def get_report_descriptor(self, interface):
+        ''' Return the HID report descriptor of the claimed device as a
+            bytearray, or None if it has none '''
+
+        return self.report_descriptor
+
+    def read(self, size=None, timeout=None):
+        ''' Return one report as bytes (or a list of ints), or None if
+            no report arrives before the timeout (milliseconds) '''
+
+        raise NotImplementedError
+
+    def release(self, interface):
+        ''' Give control of the device back to the kernel '''
+
+        pass
+
+class PyUSB_Transport(USB_Transport):
+    ''' Read a physical mouse through pyusb.
+
+        Reads are sized from the endpoint's wMaxPacketSize.
+
+        timeout = read timeout in milliseconds, None to derive it from
+                  the endpoint's bInterval
+        intervals = polling intervals per read timeout when derived
+        transfers = interrupt transfers kept in flight. With more than
+                    one, reader threads keep the endpoint queued so no
+                    report is missed between reads. Reports that finish
+                    within a few microseconds of each other may then be
+                    delivered out of order. '''
+
+    def __init__(self, timeout=None, intervals=250, transfers=1):
+        super(PyUSB_Transport, self).__init__()
+
+        if(usb is None):
+            raise Transport_Error("pyusb is required to read physical devices")
+
+        self.timeout = timeout          # Read timeout in milliseconds
+        self.intervals = intervals      # Polling intervals per derived timeout
+        self.transfers = transfers      # Transfers kept in flight
+        self.packet_size = self.report_size
+        self.buff = None                # Preallocated read buffer
+
+        self.readers = []               # Threads keeping transfers queued
+        self.reports = None             # Reports read by those threads
+        self.claimed = False            # Interface is claimed
+
+    def get_device_ids(self):
+        ''' Get all connected devices '''
+
+        dev_ids = [[], []]
+        devices = usb.core.find(find_all=True)
+
+        # Store a list of all attached vendor and product IDs
+        for cfg in devices:
+            dev_ids[0].append(int(cfg.idVendor))
+            dev_ids[1].append(int(cfg.idProduct))
+
+        return dev_ids
+
+    def open(self, vendor, prod_id, bus=None, address=None):
+        ''' Find the device by vendor and product ID, and by bus and
+            address if set so identical mice can be told apart '''
+
+        location = {}
+        if(bus is not None):
+            location["bus"] = bus
+        if(address is not None):
+            location["address"] = address
+
+        device = usb.core.find(idVendor=vendor, idProduct=prod_id, **location)
+
+        if(device is None):
+            return False
+
+        self.device = device
+        return True
+
+    def claim(self, interface):
+        ''' Claim the device from the kernel '''
+
+        # Set endpoint
+        self.endpoint = self.device[0][(0, 0)][0]
+
+        # If the device is being used by the kernel
+        if(self.device.is_kernel_driver_active(interface)) is True:
+            self.device.detach_kernel_driver(interface)
+
+        # Claim the device
+        usb.util.claim_interface(self.device, interface)
+        self.claimed = True
+
+        # Size reads and timeouts from the endpoint
+        self.packet_size = self.endpoint.wMaxPacketSize
+        self.interval = endpoint_interval(self.endpoint.bInterval, self.device.speed)
+
+        if(self.timeout is None):
+            self.timeout = max(1, int(self.intervals * self.interval))
+
+        if(self.transfers > 1):
+            self.reports = Ring_Buffer(1024, DROP_OLDEST)
+            self.readers = [Thread(target=self.reader_loop) for x in range(self.transfers)]
+            for reader in self.readers:
+                reader.daemon = True
+                reader.start()
+
+    def get_report_descriptor(self, interface):
+        ''' Read the HID report descriptor of an interface '''
+
+        length = 4096
+
+        # The HID class descriptor gives the report descriptor's length
+        try:
+            extra = bytearray(self.device[0][(interface, 0)].extra_descriptors)
+            if(len(extra) >= 9 and extra[1] == 0x21 and extra[6] == 0x22):
+                length = extra[7] | (extra[8] << 8)
+        except (usb.core.USBError, IndexError, KeyError, AttributeError):
+            pass
+
+        # GET_DESCRIPTOR request for the interface's report descriptor
+        try:
+            return bytearray(self.device.ctrl_transfer(0x81, 0x06, 0x2200, interface, length))
+        except usb.core.USBError:
+            return None
+
+    def transfer(self, buff, timeout):
+        ''' Run one interrupt transfer into a preallocated array.
+            Returns the report as bytes, or None on timeout '''
+
+        try:
+            count = self.device.read(self.endpoint.bEndpointAddress, buff, timeout)
+
+        except usb.core.USBError as error:
+            if error.args == ('Operation timed out',) or error.errno == 110:
+                return None
+            raise Transport_Error(str(error), error.errno)
+
+        # The report is the only copy made
+        if(count == len(buff)):
+            return array_bytes(buff)
+        return array_bytes(buff)[:count]
+
+    def reader_loop(self):
+        ''' Keep one transfer queued on the endpoint until released '''
+
+        # Each thread reads into its own buffer
+        buff = array.array('B', [0]) * self.packet_size
+
+        while(self.claimed):
+            # Errors are passed on so read() raises them in the caller
+            try:
+                report = self.transfer(buff, self.timeout)
+            except Transport_Error as error:
+                report = error
+
+            # Stamped here, the report may wait in the queue
+            if(report is not None):
+                self.reports.put((monotonic_ns(), report))
+
+    def read(self, size=None, timeout=None):
+        ''' Read one report from the interrupt endpoint '''
+
+        if(size is None):
+            size = self.packet_size
+
+        if(timeout is None):
+            timeout = self.timeout
+
+        # Reports already read by the queued transfers
+        if(self.reports is not None):
+            reports = self.reports.get_many(1, True, timeout / 1000.0)
+            if(not reports):
+                return None
+
+            self.arrived, report = reports[0]
+            if(isinstance(report, Transport_Error)):
+                raise report
+            return report
+
+        # Reuse one buffer while the size is unchanged
+        if(self.buff is None or len(self.buff) != size):
+            self.buff = array.array('B', [0]) * size
+
+        return self.transfer(self.buff, timeout)
+
+    def release(self, interface):
+        ''' Release the device to the kernel '''
+
+        # Let queued transfers finish
+        self.claimed = False
+        [reader.join() for reader in self.readers]
+        self.readers = []
+        self.reports = None
+
+        usb.util.release_interface(self.device, interface)
+
+        if(self.device.is_kernel_driver_active(interface)) is False:
+            self.device.attach_kernel_driver(interface)
+
+        # Close the handle so it can be reopened, possibly by another process
+        usb.util.dispose_resources(self.device)
+
+class Virtual_Transport(USB_Transport):
+    ''' Base for transports that need no physical device. Reports
+        are paced against the wall clock from the first read. '''
+
+    vendor_id = 0xFFFF      # Vendor ID reported by virtual devices
+    next_prod_id = 0        # Shared counter so each device is distinct
+
+    def __init__(self, ids=None):
+        super(Virtual_Transport, self).__init__()
+
+        if(ids is None):
+            ids = (Virtual_Transport.vendor_id, Virtual_Transport.next_prod_id)
+            Virtual_Transport.next_prod_id += 1
+
+        self.ids = ids
+        self.start = None   # Wall clock time of the first read
+
+    def open(self, vendor, prod_id, bus=None, address=None):
+        ''' Virtual devices are always present '''
+
+        self.device = self
+        return (vendor, prod_id) == tuple(self.ids)
+
+    def release(self, interface):
+        ''' Reset pacing so a reconnected device starts fresh '''
+
+        self.start = None
+
+    def wait_until(self, due, timeout):
+        ''' Sleep until a report is due. Returns False if it is not
+            due within the timeout (milliseconds) '''
+
+        if(timeout is None):
+            timeout = self.default_timeout
+
+        delay = due - time.time()
+
+        if(delay > timeout / 1000.0):
+            time.sleep(timeout / 1000.0)
+            return False
+
+        if(delay > 0):
+            time.sleep(delay)
+
+        return True
+
+def endpoint_interval(b_interval, speed):
+    ''' Return the polling interval of an interrupt endpoint in
+        milliseconds '''
+
+    if(speed is not None and speed >= SPEED_HIGH):
+        return (2 ** (max(1, min(16, b_interval)) - 1)) * 0.125
+
+    return float(max(1, b_interval))
+
+def encode_delta(delta):
+    ''' Encode a signed movement as a single report byte '''
+
+    return int(max(-127, min(127, delta))) & 0xFF
+
+class Synthetic_Transport(Virtual_Transport):
+    ''' Generate mouse reports at a fixed rate.
+
+        rate = reports per second
+        pattern = "circle" traces a circle, "random" walks randomly
+        speed = peak movement per report (1 - 127)
+        lr_col, ud_col = report columns matching Mouse_Movement '''
+
+    def __init__(self, rate=1000, pattern="circle", speed=20, seed=None,
+                 lr_col=1, ud_col=2, ids=None):
+        super(Synthetic_Transport, self).__init__(ids)
+
+        self.rate = float(rate)     # Reports per second
+        self.interval = 1000.0 / rate
+        self.pattern = pattern      # Movement pattern
+        self.speed = speed          # Peak movement per report
+        self.lr_col = lr_col        # Left/Right col in report
+        self.ud_col = ud_col        # Up/Down col in report
+        self.count = 0              # Reports generated
+        self.random = random.Random(seed)
+
+    def release(self, interface):
+        super(Synthetic_Transport, self).release(interface)
+        self.count = 0
+
+    def generate(self, size):
+        ''' Build the next report '''
+
+        if(self.pattern == "random"):
+            d_x = self.random.randint(-self.speed, self.speed)
+            d_y = self.random.randint(-self.speed, self.speed)
+        else:
+            # One revolution per second
+            angle = 2 * math.pi * self.count / self.rate
+            d_x = int(round(self.speed * math.cos(angle)))
+            d_y = int(round(self.speed * math.sin(angle)))
+
+        report = bytearray(size)
+        report[self.lr_col] = encode_delta(d_x)
+        report[self.ud_col] = encode_delta(d_y)
+
+        return bytes(report)
+
+    def read(self, size=None, timeout=None):
+        ''' Return the next report once it is due '''
+
+        if(self.start is None):
+            self.start = time.time()
+
+        if(not self.wait_until(self.start + self.count / self.rate, timeout)):
+            return None
+
+        report = self.generate(size or self.report_size)
+        self.count += 1
+
+        return report
+
+class Replay_Transport(Virtual_Transport):
+    ''' Play back recorded reports with their original timing.
+
+        records = a list of (seconds, report) pairs in capture order
+        speed = playback speed multiplier
+        loop = restart from the beginning when the recording ends
+        layout = Report_Layout of the recorded device, if it had one
+
+        Once the recording ends without looping, reads time out as
+        an idle mouse would and finished is set. '''
+
+    def __init__(self, records, speed=1.0, loop=False, ids=None, layout=None):
+        super(Replay_Transport, self).__init__(ids)
+
+        self.layout = layout        # Report_Layout of the recorded device
+        self.records = records      # (seconds, report) pairs
+        self.speed = float(speed)   # Playback speed multiplier
+        self.loop = loop            # Restart at the end
+        self.position = 0           # Next record to play
+        self.finished = False       # Recording fully played
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        ''' Load a text recording. Each line holds a timestamp in
+            seconds followed by the report bytes, separated by
+            whitespace '''
+
+        records = []
+
+        with open(path) as recording:
+            for line in recording:
+                fields = line.split()
+                if(len(fields) < 2 or fields[0].startswith('#')):
+                    continue
+                records.append((float(fields[0]), [int(value) for value in fields[1:]]))
+
+        return cls(records, **kwargs)
+
+    def release(self, interface):
+        super(Replay_Transport, self).release(interface)
+        self.position = 0
+        self.finished = False
+
+    def read(self, size=None, timeout=None):
+        ''' Return the next recorded report once it is due '''
+
+        if(self.position >= len(self.records)):
+            if(self.loop and len(self.records) > 0):
+                self.position = 0
+                self.start = None
+            else:
+                self.finished = True
+                self.wait_until(float('inf'), timeout)
+                return None
+
+        if(self.start is None):
+            self.start = time.time()
+
+        offset = self.records[self.position][0] - self.records[0][0]
+        if(not self.wait_until(self.start + offset / self.speed, timeout)):
+            return None
+
+        report = self.records[self.position][1]
+        self.position += 1
+
+        return bytes(bytearray(report))
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Micro-benchmark of the per-report cost of decoding
+    movements. Compares the reference decoder, the lookup table decoder
+    and, if NumPy is installed, batch decoding. Checks that every
+    decoder gives the same results. '''
+
+import random
+import timeit
+from USB_Device import Mouse_Movement
+
+# NumPy is only needed for the batch comparison
+try:
+    import numpy as np
+    from Movement_Batch import decode_reports, LR_DIRS, UD_DIRS
+except ImportError:
+    decode_reports = None
+
+COUNT = 100000      # Reports decoded per run
+REPEAT = 5          # Runs, the fastest is reported
+
+# Random reports covering every byte value
+generator = random.Random(0)
+reports = [[0] + [generator.randint(0, 255) for x in range(7)] for y in range(COUNT)]
+movements = [Mouse_Movement(0, report) for report in reports]
+
+def reference():
+    for movement in movements:
+        movement.analyze_dir() + movement.analyze_spd()
+
+def tables():
+    for movement in movements:
+        movement.decoded = None
+        movement.decode()
+
+def batch():
+    decode_reports(report_array)
+
+def per_report(function):
+    ''' Return the fastest per-report cost of a decoder in nanoseconds '''
+
+    return min(timeit.repeat(function, number=1, repeat=REPEAT)) / COUNT * 1e9
+
+# Every decoder must agree
+for movement in movements:
+    movement.decoded = None
+    assert movement.decode() == movement.analyze_dir() + movement.analyze_spd()
+
+print("Reference decode:  %8.1f ns/report" % per_report(reference))
+print("Table decode:      %8.1f ns/report" % per_report(tables))
+
+if(decode_reports is not None):
+    report_array = np.array(reports, dtype=np.uint8)
+    decoded = decode_reports(report_array)
+    for index, movement in enumerate(movements):
+        assert (LR_DIRS[decoded[0][index]], UD_DIRS[decoded[1][index]],
+                decoded[2][index], decoded[3][index]) == movement.decode()
+
+    print("Batch decode:      %8.1f ns/report" % per_report(batch))
@@ -5,6 +5,7 @@
 
     Description: Read data from multiple mice concurrently '''
 
+import select
 from USB_Device import USB_Mouse
 
 # Initialize USB_Mouse objects
@@ -17,12 +18,15 @@ device_0.connect()
 # Pair with the second device
 device_1.connect()
 
-# Read all connected devices concurrently with devices labeled
-device_0.read_all(sync=False)
+# Read all connected devices concurrently in the background
+device_0.read_all(verbosity=0, sync=False)
 
 # Loop reading 50 movements from both devices
 x = 0
 while(x < 50):
+    # Sleep until either device has a movement
+    select.select([device_0.movements, device_1.movements], [], [])
+
     movement_0 = device_0.get_movement(label=True)
     movement_1 = device_1.get_movement(label=True)
     movement = (movement_0, movement_1)
@@ -33,12 +37,13 @@ while(x < 50):
 
 # Loop reading 50 movements from device 1
 x = 0
-while(x < 50):
-    movement = device_1.get_movement(label=True)
-    if(movement != None):
-        print movement
-        x += 1
-
-# Disconnect devices
+for movement in device_1.iter_movements(label=True, verbosity=2):
+    print movement
+    x += 1
+    if(x == 50):
+        break
+
+# Stop reading and disconnect devices
+device_0.stop()
 device_0.disconnect()
 device_1.disconnect()
@@ -14,15 +14,12 @@ device = USB_Mouse()
 device.connect()
 
 # Read the device in the background
-device.read(sync=False)
+device.read(verbosity=0, sync=False)
 
-# Loop reading 20 movements
-x = 0
-while(x < 20):
-    movement = device.get_movement()
-    if(movement != None):
-        print movement
-        x += 1
+# Read 20 movements, waiting for each one to arrive
+for x in range(20):
+    print device.get_movement(timeout=None)
 
-# Disconnect the device
+# Stop reading and disconnect the device
+device.stop()
 device.disconnect()
@@ -0,0 +1,23 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Read several virtual mice without hardware or root '''
+
+from USB_Device import USB_Mouse
+from USB_Transport import Synthetic_Transport
+
+# Initialize four USB_Mouse objects backed by 1 kHz synthetic devices
+devices = [USB_Mouse(Synthetic_Transport(rate=1000)) for x in range(4)]
+
+# Pair with the virtual devices (no prompts)
+for device in devices:
+    device.connect()
+
+# Read all connected devices concurrently until keyboard interrupt (CTRL+C)
+devices[0].read_all(label=True)
+
+# Disconnect devices
+for device in devices:
+    device.disconnect()
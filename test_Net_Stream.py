@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+''' Author: Peter Swanson
+            pswanson@ucdavis.edu
+
+    Description: Loopback tests of Net_Stream. Movements are published
+    to a subscriber on 127.0.0.1 over UDP and over TCP, and checked
+    for their contents, lost message counting, partial batches and
+    batches limited to one datagram.
+
+    Version: Python 2.7 '''
+
+import struct
+import time
+import unittest
+from HID_Descriptor import parse_layout
+from Net_Stream import Movement_Publisher, Movement_Subscriber, HEADER, MOVEMENTS
+from USB_Device import USB_Mouse, Mouse_Movement, HID_Movement
+from USB_Transport import Synthetic_Transport
+
+# 5 buttons, 12 bit X and Y, 8 bit wheel and 4 constant bytes: 9 byte
+# reports that are not byte aligned
+DESCRIPTOR = bytearray([0x05, 0x01, 0x09, 0x02, 0xA1, 0x01, 0x09, 0x01, 0xA1, 0x00,
+                        0x05, 0x09, 0x19, 0x01, 0x29, 0x05, 0x15, 0x00, 0x25, 0x01,
+                        0x95, 0x05, 0x75, 0x01, 0x81, 0x02,
+                        0x95, 0x01, 0x75, 0x03, 0x81, 0x01,
+                        0x05, 0x01, 0x16, 0x01, 0xF8, 0x26, 0xFF, 0x07, 0x75, 0x0C,
+                        0x95, 0x02, 0x09, 0x30, 0x09, 0x31, 0x81, 0x06,
+                        0x15, 0x81, 0x25, 0x7F, 0x75, 0x08, 0x95, 0x01, 0x09, 0x38, 0x81, 0x06,
+                        0x75, 0x08, 0x95, 0x04, 0x81, 0x01, 0xC0, 0xC0])
+
+REPORT = b'\x00\x05\xfb\x00\x00\x00\x00\x00'
+
+def hid_report(buttons, x, y, wheel):
+    ''' Return a report of DESCRIPTOR's layout '''
+
+    value = buttons | ((x & 0xFFF) << 8) | ((y & 0xFFF) << 20)
+    return struct.pack('<Ib4x', value, wheel)
+
+def make_device(num, layout=None):
+    ''' Return an unconnected device to publish '''
+
+    device = USB_Mouse(Synthetic_Transport())
+    device.num = num
+    device.layout = layout
+    return device
+
+class Net_Stream_Tests(object):
+    ''' Tests run over each protocol '''
+
+    protocol = None
+    latency = 0.05
+
+    def setUp(self):
+        self.layout = parse_layout(DESCRIPTOR)
+        self.devices = [make_device(0), make_device(1, self.layout)]
+
+        self.subscriber = Movement_Subscriber(0, protocol=self.protocol)
+        self.publisher = Movement_Publisher(("127.0.0.1", self.subscriber.port), self.devices,
+                                            self.protocol, batch=4, latency=self.latency)
+
+    def tearDown(self):
+        self.publisher.close()
+        self.subscriber.close()
+
+    def receive(self, count, timeout=2.0):
+        ''' Return the movements received until count arrive or the
+            timeout passes '''
+
+        movements = []
+        end = time.time() + timeout
+
+        while(len(movements) < count and time.time() < end):
+            movements += self.subscriber.get_movements(None, 0.05)
+
+        return movements
+
+    def write(self, count, start=0):
+        ''' Publish count column decoded movements '''
+
+        for index in range(count):
+            self.publisher.write(self.devices[0], Mouse_Movement(0, REPORT, timestamp=start + index))
+
+    def test_round_trip(self):
+        self.write(3)
+        self.publisher.write(self.devices[1], HID_Movement(1, hid_report(3, 1000, -700, -2),
+                                                           self.layout, timestamp=3.5))
+
+        movements = self.receive(4)
+
+        self.assertEqual(len(movements), 4)
+        self.assertEqual([movement.time for movement in movements], [0, 1, 2, 3.5])
+        self.assertEqual(movements[0].data, REPORT)
+        self.assertEqual(movements[0].get_data(), Mouse_Movement(0, REPORT).get_data())
+
+        # Reports longer than 8 bytes keep their layout
+        self.assertTrue(isinstance(movements[3], HID_Movement))
+        self.assertEqual(movements[3].device, 1)
+        self.assertEqual(len(movements[3].data), 9)
+        self.assertEqual(tuple(movements[3].fields), (3, 1000, -700, -2))
+
+        self.assertEqual(self.subscriber.lost, 0)
+        self.assertEqual(self.subscriber.unknown, 0)
+
+    def test_partial_batch(self):
+        # One movement never fills the batch of 4, it is sent after the latency
+        self.write(1)
+        movements = self.receive(1, 1.0)
+
+        self.assertEqual(len(movements), 1)
+        self.assertEqual(movements[0].time, 0)
+
+    def test_lost_messages(self):
+        self.write(4)
+        self.assertEqual(len(self.receive(4)), 4)
+
+        # Drop the next 3 movements messages in transit
+        send = self.publisher.send
+        dropped = []
+
+        def lossy_send(message):
+            if(len(dropped) < 3 and HEADER.unpack_from(message)[2] == MOVEMENTS):
+                dropped.append(message)
+                return True
+            return send(message)
+
+        self.publisher.send = lossy_send
+
+        self.write(16, 4)
+        movements = self.receive(4)
+
+        self.assertEqual([movement.time for movement in movements], [16, 17, 18, 19])
+        self.assertEqual(self.subscriber.lost, 3)
+
+class UDP_Tests(Net_Stream_Tests, unittest.TestCase):
+    protocol = "udp"
+
+    def test_large_batch(self):
+        # Batches are limited to what fits in one datagram
+        publisher = Movement_Publisher(("127.0.0.1", self.subscriber.port), self.devices,
+                                       self.protocol, batch=4000, latency=self.latency)
+
+        self.assertTrue(HEADER.size + publisher.batch * publisher.frame.size <= 65507)
+
+        for index in range(4000):
+            publisher.write(self.devices[0], Mouse_Movement(0, REPORT, timestamp=index))
+
+        movements = self.receive(4000)
+        publisher.close()
+
+        self.assertEqual(len(movements), 4000)
+        self.assertEqual(publisher.errors, 0)
+        self.assertEqual(publisher.sent, 4000)
+
+class TCP_Tests(Net_Stream_Tests, unittest.TestCase):
+    protocol = "tcp"
+
+if __name__ == '__main__':
+    unittest.main()